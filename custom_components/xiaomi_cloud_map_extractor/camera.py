@@ -1,9 +1,10 @@
+import asyncio
 import io
 import logging
 import time
 from datetime import timedelta
 from enum import Enum
-from typing import Any, Dict, List, Optional
+from typing import Any, Callable, Dict, List, Optional
 
 from custom_components.xiaomi_cloud_map_extractor.common.backoff import Backoff
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import MapData
@@ -15,14 +16,18 @@ try:
 except ImportError:
     from miio import Vacuum as RoborockVacuum, DeviceException
 import PIL.Image as Image
+import aiohttp
 import voluptuous as vol
 from homeassistant.components.camera import Camera, CameraEntityFeature, ENTITY_ID_FORMAT, PLATFORM_SCHEMA
 from homeassistant.const import CONF_HOST, CONF_NAME, CONF_PASSWORD, CONF_TOKEN, CONF_USERNAME
 from homeassistant.helpers import config_validation as cv
+from homeassistant.helpers.aiohttp_client import async_create_clientsession
 from homeassistant.helpers.entity import generate_entity_id
 from homeassistant.helpers.reload import async_setup_reload_service
+from homeassistant.helpers.storage import Store
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data_parser import MapDataParser
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.common.xiaomi_cloud_connector import XiaomiCloudConnector
 from custom_components.xiaomi_cloud_map_extractor.const import *
 from custom_components.xiaomi_cloud_map_extractor.dreame.vacuum import DreameVacuum
@@ -35,6 +40,12 @@ _LOGGER = logging.getLogger(__name__)
 
 SCAN_INTERVAL = timedelta(seconds=5)
 
+STORAGE_VERSION = 1
+STORAGE_DEVICE = "device"
+STORAGE_SESSION = "session"
+STORAGE_USER_ID = "user_id"
+STORAGE_DEVICE_ID = "device_id"
+
 DEFAULT_TRIMS = {
     CONF_LEFT: 0,
     CONF_RIGHT: 0,
@@ -81,6 +92,8 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
             vol.Schema({
                 vol.Optional(CONF_SCALE, default=1): POSITIVE_FLOAT_SCHEMA,
                 vol.Optional(CONF_ROTATE, default=0): vol.In([0, 90, 180, 270]),
+                vol.Optional(CONF_PATH_SUPERSAMPLING): POSITIVE_FLOAT_SCHEMA,
+                vol.Optional(CONF_PATH_SIMPLIFICATION, default=0): POSITIVE_FLOAT_SCHEMA,
                 vol.Optional(CONF_TRIM, default=DEFAULT_TRIMS): vol.Schema({
                     vol.Optional(CONF_LEFT, default=0): PERCENT_SCHEMA,
                     vol.Optional(CONF_RIGHT, default=0): PERCENT_SCHEMA,
@@ -119,7 +132,8 @@ PLATFORM_SCHEMA = PLATFORM_SCHEMA.extend(
         vol.Optional(CONF_STORE_MAP_RAW, default=False): cv.boolean,
         vol.Optional(CONF_STORE_MAP_IMAGE, default=False): cv.boolean,
         vol.Optional(CONF_STORE_MAP_PATH, default="/tmp"): cv.string,
-        vol.Optional(CONF_FORCE_API, default=None): vol.Or(vol.In(CONF_AVAILABLE_APIS), vol.Equal(None))
+        vol.Optional(CONF_FORCE_API, default=None): vol.Or(vol.In(CONF_AVAILABLE_APIS), vol.Equal(None)),
+        vol.Optional(CONF_MAP_NAME_CACHE_TIME, default=300): cv.positive_int
     })
 
 
@@ -148,10 +162,12 @@ async def async_setup_platform(hass, config, async_add_entities, discovery_info=
     store_map_image = config[CONF_STORE_MAP_IMAGE]
     store_map_path = config[CONF_STORE_MAP_PATH]
     force_api = config[CONF_FORCE_API]
+    map_name_cache_time = config[CONF_MAP_NAME_CACHE_TIME]
     entity_id = generate_entity_id(ENTITY_ID_FORMAT, name, hass=hass)
+    session = async_create_clientsession(hass)
     async_add_entities([VacuumCamera(entity_id, host, token, username, password, country, name, should_poll,
                                      image_config, colors, drawables, sizes, texts, attributes, store_map_raw,
-                                     store_map_image, store_map_path, force_api)])
+                                     store_map_image, store_map_path, force_api, map_name_cache_time, session)])
 
 
 class VacuumCamera(Camera):
@@ -160,12 +176,14 @@ class VacuumCamera(Camera):
     def __init__(self, entity_id: str, host: str, token: str, username: str, password: str, country: str, name: str,
                  should_poll: bool, image_config: ImageConfig, colors: Colors, drawables: Drawables, sizes: Sizes,
                  texts: Texts, attributes: List[str], store_map_raw: bool, store_map_image: bool, store_map_path: str,
-                 force_api: str):
+                 force_api: str, map_name_cache_time: int, session: Optional[aiohttp.ClientSession] = None):
         super().__init__()
         self.entity_id = entity_id
         self.content_type = CONTENT_TYPE
         self._vacuum = RoborockVacuum(host, token)
-        self._connector = XiaomiCloudConnector(username, password)
+        self._connector = XiaomiCloudConnector(username, password, session)
+        self._username = username
+        self._store = None
         self._status = CameraStatus.INITIALIZING
         self._device = None
         self._name = name
@@ -176,10 +194,12 @@ class VacuumCamera(Camera):
         self._sizes = sizes
         self._texts = texts
         self._attributes = attributes
+        self._parse_plan = ParsePlan(drawables, attributes)
         self._store_map_raw = store_map_raw
         self._store_map_image = store_map_image
         self._store_map_path = store_map_path
         self._forced_api = force_api
+        self._map_name_cache_time = map_name_cache_time
         self._used_api = None
         self._map_saved = None
         self._image = None
@@ -189,6 +209,8 @@ class VacuumCamera(Camera):
         self._country = country
 
     async def async_added_to_hass(self) -> None:
+        self._store = Store(self.hass, STORAGE_VERSION, f"{DOMAIN}.{self.entity_id}")
+        await self._async_restore_state()
         self.async_schedule_update_ha_state(True)
 
     @property
@@ -222,6 +244,10 @@ class VacuumCamera(Camera):
         if self._device is not None:
             attributes[ATTR_MODEL] = self._device.model
             attributes[ATTR_USED_API] = self._used_api
+            if ATTRIBUTE_MAP_CACHE_HITS in self._attributes:
+                attributes[ATTRIBUTE_MAP_CACHE_HITS] = self._device.map_cache_hits
+            if ATTRIBUTE_MAP_CACHE_MISSES in self._attributes:
+                attributes[ATTRIBUTE_MAP_CACHE_MISSES] = self._device.map_cache_misses
         if self._connector.two_factor_auth_url is not None:
             attributes[ATTR_TWO_FACTOR_AUTH] = self._connector.two_factor_auth_url
         return attributes
@@ -238,47 +264,47 @@ class VacuumCamera(Camera):
             rooms = dict(filter(lambda x: x[0] is not None, ((x[0], x[1].name) for x in map_data.rooms.items())))
             if len(rooms) == 0:
                 rooms = list(map_data.rooms.keys())
-        for name, value in {
-            ATTRIBUTE_CALIBRATION: map_data.calibration(),
-            ATTRIBUTE_CARPET_MAP: map_data.carpet_map,
-            ATTRIBUTE_CHARGER: map_data.charger,
-            ATTRIBUTE_CLEANED_ROOMS: map_data.cleaned_rooms,
-            ATTRIBUTE_COUNTRY: country,
-            ATTRIBUTE_GOTO: map_data.goto,
-            ATTRIBUTE_GOTO_PATH: map_data.goto_path,
-            ATTRIBUTE_GOTO_PREDICTED_PATH: map_data.predicted_path,
-            ATTRIBUTE_IGNORED_OBSTACLES: map_data.ignored_obstacles,
-            ATTRIBUTE_IGNORED_OBSTACLES_WITH_PHOTO: map_data.ignored_obstacles_with_photo,
-            ATTRIBUTE_IMAGE: map_data.image,
-            ATTRIBUTE_IS_EMPTY: map_data.image.is_empty,
-            ATTRIBUTE_MAP_NAME: map_data.map_name,
-            ATTRIBUTE_MOP_PATH: map_data.mop_path,
-            ATTRIBUTE_NO_CARPET_AREAS: map_data.no_carpet_areas,
-            ATTRIBUTE_NO_GO_AREAS: map_data.no_go_areas,
-            ATTRIBUTE_NO_MOPPING_AREAS: map_data.no_mopping_areas,
-            ATTRIBUTE_OBSTACLES: map_data.obstacles,
-            ATTRIBUTE_OBSTACLES_WITH_PHOTO: map_data.obstacles_with_photo,
-            ATTRIBUTE_PATH: map_data.path,
-            ATTRIBUTE_ROOM_NUMBERS: rooms,
-            ATTRIBUTE_ROOMS: map_data.rooms,
-            ATTRIBUTE_VACUUM_POSITION: map_data.vacuum_position,
-            ATTRIBUTE_VACUUM_ROOM: map_data.vacuum_room,
-            ATTRIBUTE_VACUUM_ROOM_NAME: map_data.vacuum_room_name,
-            ATTRIBUTE_WALLS: map_data.walls,
-            ATTRIBUTE_ZONES: map_data.zones
+        for name, get_value in {
+            ATTRIBUTE_CALIBRATION: map_data.calibration,
+            ATTRIBUTE_CARPET_MAP: lambda: map_data.carpet_map,
+            ATTRIBUTE_CHARGER: lambda: map_data.charger,
+            ATTRIBUTE_CLEANED_ROOMS: lambda: map_data.cleaned_rooms,
+            ATTRIBUTE_COUNTRY: lambda: country,
+            ATTRIBUTE_GOTO: lambda: map_data.goto,
+            ATTRIBUTE_GOTO_PATH: lambda: map_data.goto_path,
+            ATTRIBUTE_GOTO_PREDICTED_PATH: lambda: map_data.predicted_path,
+            ATTRIBUTE_IGNORED_OBSTACLES: lambda: map_data.ignored_obstacles,
+            ATTRIBUTE_IGNORED_OBSTACLES_WITH_PHOTO: lambda: map_data.ignored_obstacles_with_photo,
+            ATTRIBUTE_IMAGE: lambda: map_data.image,
+            ATTRIBUTE_IS_EMPTY: lambda: map_data.image.is_empty,
+            ATTRIBUTE_MAP_NAME: lambda: map_data.map_name,
+            ATTRIBUTE_MOP_PATH: lambda: map_data.mop_path,
+            ATTRIBUTE_NO_CARPET_AREAS: lambda: map_data.no_carpet_areas,
+            ATTRIBUTE_NO_GO_AREAS: lambda: map_data.no_go_areas,
+            ATTRIBUTE_NO_MOPPING_AREAS: lambda: map_data.no_mopping_areas,
+            ATTRIBUTE_OBSTACLES: lambda: map_data.obstacles,
+            ATTRIBUTE_OBSTACLES_WITH_PHOTO: lambda: map_data.obstacles_with_photo,
+            ATTRIBUTE_PATH: lambda: map_data.path,
+            ATTRIBUTE_ROOM_NUMBERS: lambda: rooms,
+            ATTRIBUTE_ROOMS: lambda: map_data.rooms,
+            ATTRIBUTE_VACUUM_POSITION: lambda: map_data.vacuum_position,
+            ATTRIBUTE_VACUUM_ROOM: lambda: map_data.vacuum_room,
+            ATTRIBUTE_VACUUM_ROOM_NAME: lambda: map_data.vacuum_room_name,
+            ATTRIBUTE_WALLS: lambda: map_data.walls,
+            ATTRIBUTE_ZONES: lambda: map_data.zones
         }.items():
             if name in attributes_to_return:
-                attributes[name] = value
+                attributes[name] = get_value()
         return attributes
 
-    def update(self):
+    async def async_update(self):
         counter = 10
         if self._status != CameraStatus.TWO_FACTOR_AUTH_REQUIRED and not self._logged_in:
-            self._handle_login()
+            await self._async_handle_login()
         if self._device is None and self._logged_in:
-            self._handle_device()
+            await self._async_handle_device()
 
-        new_map_name = self._handle_map_name(counter)
+        new_map_name = await self._async_add_executor_job(self._handle_map_name, counter)
         if new_map_name != "retry":
             # sometimes this fails for no reason, so try and mitigate that by
             # falling back to the previous map name if we have one
@@ -288,36 +314,40 @@ class VacuumCamera(Camera):
             self._status = CameraStatus.FAILED_TO_RETRIEVE_MAP_FROM_VACUUM
 
         if self._logged_in and self._map_name is not None and self._device is not None:
-            self._handle_map_data(self._map_name)
+            await self._async_handle_map_data(self._map_name)
         else:
             _LOGGER.debug("Unable to retrieve map, reasons: Logged in - %s, map name - %s, device retrieved - %s",
                           self._logged_in, new_map_name, self._device is not None)
-            self._set_map_data(MapDataParser.create_empty(self._colors, str(self._status)))
+            await self._async_add_executor_job(self._set_map_data,
+                                               MapDataParser.create_empty(self._colors, str(self._status)))
         self._logged_in_previously = self._logged_in
 
-    def _handle_login(self):
+    async def _async_handle_login(self):
         _LOGGER.debug("Logging in...")
-        self._logged_in = self._connector.login()
+        self._logged_in = await self._connector.async_login()
         if self._logged_in is None:
             _LOGGER.debug("2FA required")
             self._status = CameraStatus.TWO_FACTOR_AUTH_REQUIRED
         elif self._logged_in:
             _LOGGER.debug("Logged in")
             self._status = CameraStatus.LOGGED_IN
+            await self._async_store_state()
         else:
             _LOGGER.debug("Failed to log in")
             self._status = CameraStatus.FAILED_LOGIN
             if self._logged_in_previously:
                 _LOGGER.error("Unable to log in, check credentials")
 
-    def _handle_device(self):
+    async def _async_handle_device(self):
         _LOGGER.debug("Retrieving device info, country: %s", self._country)
-        country, user_id, device_id, model = self._connector.get_device_details(self._vacuum.token, self._country)
+        country, user_id, device_id, model = await self._connector.async_get_device_details(self._vacuum.token,
+                                                                                            self._country)
         if model is not None:
             self._country = country
             _LOGGER.debug("Retrieved device model: %s", model)
             self._device = self._create_device(user_id, device_id, model)
             _LOGGER.debug("Created device, used api: %s", self._used_api)
+            await self._async_store_state()
         else:
             _LOGGER.error("Failed to retrieve model")
             self._status = CameraStatus.FAILED_TO_RETRIEVE_DEVICE
@@ -356,15 +386,23 @@ class VacuumCamera(Camera):
             time.sleep(backoff.backoff())
         return map_name
 
-    def _handle_map_data(self, map_name: str):
+    async def _async_handle_map_data(self, map_name: str):
         _LOGGER.debug("Retrieving map from Xiaomi cloud")
+        response = await self._device.async_get_raw_map_data(map_name)
+        await self._async_add_executor_job(self._handle_map_data, map_name, response)
+
+    def _handle_map_data(self, map_name: str, response: Optional[bytes]):
         store_map_path = self._store_map_path if self._store_map_raw else None
-        map_data, map_stored = self._device.get_map(map_name, self._colors, self._drawables, self._texts,
-                                                    self._sizes, self._image_config, store_map_path)
+        map_data, map_stored = self._device.get_map_from_raw_data(map_name, response, self._colors, self._drawables,
+                                                                  self._texts, self._sizes, self._image_config,
+                                                                  store_map_path, self._parse_plan)
         if map_data is not None:
             # noinspection PyBroadException
             try:
                 _LOGGER.debug("Map data retrieved")
+                # attributes are read in event loop, so lazily decoded fields they use have to be decoded here
+                self.extract_attributes(map_data, self._attributes, self._country)
+                map_data.discard_lazy_fields()
                 self._map_saved = map_stored
                 if map_data.image.is_empty:
                     _LOGGER.debug("Map is empty")
@@ -384,16 +422,60 @@ class VacuumCamera(Camera):
             self._status = CameraStatus.UNABLE_TO_RETRIEVE_MAP
 
     def _set_map_data(self, map_data: MapData):
+        if map_data is self._map_data:
+            # map retrieved from device's cache, image is already encoded
+            return
         img_byte_arr = io.BytesIO()
         map_data.image.data.save(img_byte_arr, format='PNG')
         self._image = img_byte_arr.getvalue()
         self._map_data = map_data
         self._store_image()
 
+    async def _async_restore_state(self):
+        stored = await self._store.async_load()
+        if stored is None or stored.get(CONF_USERNAME) != self._username \
+                or stored.get(CONF_TOKEN) != self._vacuum.token:
+            return
+        device = stored.get(STORAGE_DEVICE)
+        if device is None or (self._country is not None and self._country != device[CONF_COUNTRY]):
+            return
+        self._country = device[CONF_COUNTRY]
+        self._device = self._create_device(device[STORAGE_USER_ID], device[STORAGE_DEVICE_ID], device[ATTR_MODEL])
+        _LOGGER.debug("Restored device, used api: %s", self._used_api)
+        # restored session is validated by the first API call, failed call results in a new login
+        session = stored.get(STORAGE_SESSION)
+        if session is not None and self._connector.restore_session_data(session):
+            _LOGGER.debug("Restored session of previous login")
+            self._logged_in = True
+            self._status = CameraStatus.LOGGED_IN
+
+    async def _async_store_state(self):
+        if self._store is None:
+            return
+        device = None
+        if self._device is not None:
+            device = {
+                CONF_COUNTRY: self._country,
+                STORAGE_USER_ID: self._device.user_id,
+                STORAGE_DEVICE_ID: self._device.device_id,
+                ATTR_MODEL: self._device.model
+            }
+        await self._store.async_save({
+            CONF_USERNAME: self._username,
+            CONF_TOKEN: self._vacuum.token,
+            STORAGE_SESSION: self._connector.get_session_data(),
+            STORAGE_DEVICE: device
+        })
+
+    async def _async_add_executor_job(self, target: Callable, *args) -> Any:
+        if self.hass is not None:
+            return await self.hass.async_add_executor_job(target, *args)
+        return await asyncio.get_running_loop().run_in_executor(None, target, *args)
+
     def _create_device(self, user_id: str, device_id: str, model: str) -> XiaomiCloudVacuum:
         self._used_api = self._detect_api(model)
         if self._used_api == CONF_AVAILABLE_API_XIAOMI:
-            return XiaomiVacuum(self._connector, self._country, user_id, device_id, model)
+            return XiaomiVacuum(self._connector, self._country, user_id, device_id, model, self._map_name_cache_time)
         if self._used_api == CONF_AVAILABLE_API_VIOMI:
             return ViomiVacuum(self._connector, self._country, user_id, device_id, model)
         if self._used_api == CONF_AVAILABLE_API_ROIDMI:
@@ -1,8 +1,9 @@
 import logging
 import math
-from typing import Callable, Dict, List
+from array import array
+from typing import Callable, Dict, List, Optional, Tuple
 
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageChops, ImageDraw, ImageFont
 from PIL.Image import Image as ImageType
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import Area, ImageData, Obstacle, Path, Point, Room, \
@@ -82,6 +83,93 @@ class ImageHandler:
         draw.text(((image.size[0] - w) / 2, (image.size[1] - h) / 2), text, fill=text_color)
         return image
 
+    @staticmethod
+    def load_pixel_types(raw_data: bytes, width: int, height: int, trim_box: Tuple[int, int, int, int],
+                         flipped: bool = False) -> ImageType:
+        """
+        Loads raw pixel types trimmed to a box (given in orientation of raw data).
+        Trimmed area is mapped directly onto raw data by its offset and row stride, so pixels are not copied.
+        Flipped pixel types are in orientation of an output image.
+        """
+        left, top, right, bottom = trim_box
+        offset = top * width + left
+        orientation = -1 if flipped else 1
+        if offset + (bottom - top) * width <= len(raw_data):
+            return Image.frombuffer('L', (right - left, bottom - top), memoryview(raw_data)[offset:], 'raw', 'L',
+                                    width, orientation)
+        # last trimmed row does not span a full stride of raw data
+        pixel_types = Image.frombuffer('L', (width, height), raw_data, 'raw', 'L', 0, 1).crop(trim_box)
+        return pixel_types.transpose(Image.FLIP_TOP_BOTTOM) if flipped else pixel_types
+
+    @staticmethod
+    def scale(image: ImageType, scale: float) -> ImageType:
+        if scale == 1:
+            return image
+        width, height = image.size
+        return image.resize((int(width * scale), int(height * scale)), resample=Image.NEAREST)
+
+    @staticmethod
+    def create_indexed_image(pixel_types: ImageType, get_pixel_color: Callable[[int], Optional[Color]],
+                             overlays: List[Tuple[Color, ImageType]] = None) -> ImageType:
+        """
+        Creates palette ("P") image of a map from pixel types (using their orientation, usually flipped one).
+        Palette consists of distinct colors of pixel types present on a map and colors of overlays, which are
+        painted over pixels selected by their masks.
+        Pixel types without color (None) are transparent.
+        """
+        palette = []
+        palette_indexes = {}
+
+        def get_palette_index(color: Optional[Color]) -> int:
+            if color is None:
+                color = (0, 0, 0, 0)
+            elif len(color) == 3:
+                color = (color[0], color[1], color[2], 0xFF)
+            if color not in palette_indexes:
+                palette_indexes[color] = len(palette)
+                palette.append(color)
+            return palette_indexes[color]
+
+        histogram = pixel_types.histogram()
+        lut = [get_palette_index(get_pixel_color(pixel_type)) if histogram[pixel_type] > 0 else 0
+               for pixel_type in range(256)]
+        image = pixel_types.point(lut)
+        for color, mask in overlays or []:
+            image.paste(get_palette_index(color), None, mask)
+        image.putpalette(b"".join(bytes(color) for color in palette), "RGBA")
+        return image
+
+    @staticmethod
+    def get_room_bounding_boxes(pixel_types: ImageType, get_room_number: Callable[[int], Optional[int]],
+                                offset: Tuple[int, int] = (0, 0), excluded: Optional[ImageType] = None) \
+            -> Dict[int, Tuple[int, int, int, int]]:
+        """
+        Calculates bounding boxes (x0, y0, x1, y1 - inclusive, moved by offset) of all rooms present in pixel types.
+        Pixel types are grouped by room number; pixels selected by excluded mask are not a part of any room.
+        Rooms are ordered by their first pixel in raw data.
+        """
+        histogram = pixel_types.histogram()
+        room_pixel_types = {}
+        for pixel_type in range(256):
+            if histogram[pixel_type] > 0:
+                room_number = get_room_number(pixel_type)
+                if room_number is not None:
+                    room_pixel_types.setdefault(room_number, set()).add(pixel_type)
+        width = pixel_types.size[0]
+        rooms = {}
+        first_pixels = {}
+        for room_number, types in room_pixel_types.items():
+            room_mask = pixel_types.point([0xFF if pixel_type in types else 0 for pixel_type in range(256)])
+            if excluded is not None:
+                room_mask = ImageChops.subtract(room_mask, excluded)
+            bbox = room_mask.getbbox()
+            if bbox is None:
+                continue
+            x0, y0, x1, y1 = bbox
+            first_pixels[room_number] = (y0, room_mask.crop((0, y0, width, y0 + 1)).getbbox()[0])
+            rooms[room_number] = (x0 + offset[0], y0 + offset[1], x1 - 1 + offset[0], y1 - 1 + offset[1])
+        return {room_number: rooms[room_number] for room_number in sorted(rooms, key=first_pixels.get)}
+
     @staticmethod
     def draw_path(image: ImageData, path: Path, sizes: Sizes, colors: Colors, scale: float):
         ImageHandler.__draw_path__(image, path, sizes[CONF_SIZE_PATH_WIDTH], ImageHandler.__get_color__(COLOR_PATH, colors), scale)
@@ -118,6 +206,7 @@ class ImageHandler:
 
     @staticmethod
     def draw_walls(image: ImageData, walls: List[Wall], colors: Colors):
+        ImageHandler.__convert_to_rgba__(image)
         draw = ImageDraw.Draw(image.data, 'RGBA')
         for wall in walls:
             draw.line(wall.to_img(image.dimensions).as_list(),
@@ -163,8 +252,8 @@ class ImageHandler:
 
     @staticmethod
     def draw_all_obstacles(image: ImageData, obstacles: List[Obstacle], radius: float, color: Color):
-        for obstacle in obstacles:
-            ImageHandler.__draw_circle__(image, obstacle, radius, color, color)
+        primitives = [ImageHandler.__get_circle__(image, obstacle, radius, color, color) for obstacle in obstacles]
+        ImageHandler.__draw_primitives_on_new_layer__(image, primitives, ImageHandler.__use_transparency__(color))
 
     @staticmethod
     def draw_vacuum_position(image: ImageData, vacuum_position: Point, sizes: Sizes, colors: Colors):
@@ -176,11 +265,13 @@ class ImageHandler:
     @staticmethod
     def draw_room_names(image: ImageData, rooms: Dict[int, Room], colors: Colors):
         color = ImageHandler.__get_color__(COLOR_ROOM_NAMES, colors)
+        primitives = []
         for room in rooms.values():
             p = room.point()
             if p is not None:
                 point = p.to_img(image.dimensions)
-                ImageHandler.__draw_text__(image, room.name, point.x, point.y, color)
+                primitives.append(ImageHandler.__get_text__(room.name, point.x, point.y, color))
+        ImageHandler.__draw_primitives_on_new_layer__(image, primitives, ImageHandler.__use_transparency__(color))
 
     @staticmethod
     def rotate(image: ImageData):
@@ -193,11 +284,14 @@ class ImageHandler:
 
     @staticmethod
     def draw_texts(image: ImageData, texts: Texts):
+        primitives = []
         for text_config in texts:
             x = text_config[CONF_X] * image.data.size[0] / 100
             y = text_config[CONF_Y] * image.data.size[1] / 100
-            ImageHandler.__draw_text__(image, text_config[CONF_TEXT], x, y, text_config[CONF_COLOR],
-                                       text_config[CONF_FONT], text_config[CONF_FONT_SIZE])
+            primitives.append(ImageHandler.__get_text__(text_config[CONF_TEXT], x, y, text_config[CONF_COLOR],
+                                                        text_config[CONF_FONT], text_config[CONF_FONT_SIZE]))
+        use_transparency = ImageHandler.__use_transparency__(*[t[CONF_COLOR] for t in texts])
+        ImageHandler.__draw_primitives_on_new_layer__(image, primitives, use_transparency)
 
     @staticmethod
     def draw_layer(image: ImageData, layer_name: str):
@@ -209,9 +303,9 @@ class ImageHandler:
 
     @staticmethod
     def __draw_vacuum__(image: ImageData, vacuum_pos, r, outline, fill):
+        vacuum_a = vacuum_pos.a if vacuum_pos.a is not None else 0
+
         def draw_func(draw: ImageDraw):
-            if vacuum_pos.a is None:
-                vacuum_pos.a = 0
             point = vacuum_pos.to_img(image.dimensions)
             r_scaled = r / 16
             # main outline
@@ -225,8 +319,8 @@ class ImageHandler:
                 coords = [x - r2, y - r2, x + r2, y + r2]
                 draw.ellipse(coords, outline=outline, fill=None)
             # bin cover
-            a1 = (vacuum_pos.a + 104) / 180 * math.pi
-            a2 = (vacuum_pos.a - 104) / 180 * math.pi
+            a1 = (vacuum_a + 104) / 180 * math.pi
+            a2 = (vacuum_a - 104) / 180 * math.pi
             r2 = r_scaled * 13
             x1 = point.x - r2 * math.cos(a1)
             y1 = point.y + r2 * math.sin(a1)
@@ -234,7 +328,7 @@ class ImageHandler:
             y2 = point.y + r2 * math.sin(a2)
             draw.line([x1, y1, x2, y2], width=1, fill=outline)
             # lidar
-            angle = vacuum_pos.a / 180 * math.pi
+            angle = vacuum_a / 180 * math.pi
             r2 = r_scaled * 3
             x = point.x + r2 * math.cos(angle)
             y = point.y - r2 * math.sin(angle)
@@ -254,84 +348,119 @@ class ImageHandler:
             coords = [x - r2, y - r2, x + r2, y + r2]
             draw.ellipse(coords, outline=half_color, fill=half_color)
 
-        ImageHandler.__draw_on_new_layer__(image, draw_func, 1, ImageHandler.__use_transparency__(outline, fill))
+        center = vacuum_pos.to_img(image.dimensions)
+        box = ImageHandler.__get_box__([center.x - r, center.y - r, center.x + r, center.y + r])
+        ImageHandler.__draw_primitives_on_new_layer__(image, [(box, draw_func)],
+                                                      ImageHandler.__use_transparency__(outline, fill))
 
     @staticmethod
-    def __draw_circle__(image: ImageData, center: Point, r: float, outline: Color, fill: Color):
+    def __get_circle__(image: ImageData, center: Point, r: float, outline: Color, fill: Color) \
+            -> Tuple[Tuple[int, int, int, int], Callable]:
+        point = center.to_img(image.dimensions)
+        coords = [point.x - r, point.y - r, point.x + r, point.y + r]
+
         def draw_func(draw: ImageDraw):
-            point = center.to_img(image.dimensions)
-            coords = [point.x - r, point.y - r, point.x + r, point.y + r]
             draw.ellipse(coords, outline=outline, fill=fill)
 
-        ImageHandler.__draw_on_new_layer__(image, draw_func, 1, ImageHandler.__use_transparency__(outline, fill))
+        return ImageHandler.__get_box__(coords), draw_func
 
     @staticmethod
     def __draw_pieslice__(image: ImageData, position, r, outline, fill):
+        point = position.to_img(image.dimensions)
+        angle = -position.a if position.a is not None else 0
+        coords = [point.x - r, point.y - r, point.x + r, point.y + r]
+
         def draw_func(draw: ImageDraw):
-            point = position.to_img(image.dimensions)
-            angle = -position.a if position.a is not None else 0
-            coords = [point.x - r, point.y - r, point.x + r, point.y + r]
             draw.pieslice(coords, angle + 90, angle - 90, outline=outline, fill=fill)
 
-        ImageHandler.__draw_on_new_layer__(image, draw_func, 1, ImageHandler.__use_transparency__(outline, fill))
+        ImageHandler.__draw_primitives_on_new_layer__(image, [(ImageHandler.__get_box__(coords), draw_func)],
+                                                      ImageHandler.__use_transparency__(outline, fill))
 
     @staticmethod
     def __draw_areas__(image: ImageData, areas: List[Area], fill: Color, outline: Color):
         if len(areas) == 0:
             return
 
-        use_transparency = ImageHandler.__use_transparency__(outline, fill)
+        primitives = []
         for area in areas:
-            def draw_func(draw: ImageDraw):
-                draw.polygon(area.to_img(image.dimensions).as_list(), fill, outline)
+            coords = area.to_img(image.dimensions).as_list()
+
+            def draw_func(draw: ImageDraw, polygon=coords):
+                draw.polygon(polygon, fill, outline)
 
-            ImageHandler.__draw_on_new_layer__(image, draw_func, 1, use_transparency)
+            primitives.append((ImageHandler.__get_box__(coords), draw_func))
+        ImageHandler.__draw_primitives_on_new_layer__(image, primitives,
+                                                      ImageHandler.__use_transparency__(outline, fill))
 
     @staticmethod
     def __draw_path__(image: ImageData, path: Path, path_width: int, color: Color, scale: float):
-        if len(path.path) < 1:
+        sub_paths = [coords for coords in path.path if len(coords) > 2]
+        if len(sub_paths) == 0:
+            return
+        ImageHandler.__convert_to_rgba__(image)
+        use_transparency = ImageHandler.__use_transparency__(color)
+        width, height = image.data.size
+        corners = array("d", [min(min(c[0::2]) for c in sub_paths), min(min(c[1::2]) for c in sub_paths),
+                              max(max(c[0::2]) for c in sub_paths), max(max(c[1::2]) for c in sub_paths)])
+        x0, y0, x1, y1 = ImageHandler.__get_box__(image.dimensions.to_img_coords(corners),
+                                                  math.ceil(path_width / 2) + 2)
+        x0, y0, x1, y1 = max(x0, 0), max(y0, 0), min(x1, width), min(y1, height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        if scale == 1 and not use_transparency:
+            left, top = 0, 0
+            mask = None
+            draw = ImageDraw.Draw(image.data, "RGBA")
+            fill = color
+        else:
+            # path has a single color, so it is drawn on a coverage mask covering only the path's bounding box,
+            # upscaled by the supersampling factor
+            left, top = math.floor(x0 * scale), math.floor(y0 * scale)
+            mask = Image.new("L", (math.ceil(x1 * scale) - left, math.ceil(y1 * scale) - top), 0)
+            draw = ImageDraw.Draw(mask)
+            fill = 255
+        line_width = int(scale * path_width)
+        r = scale * path_width / 2
+        for coords in path.to_img(image.dimensions, scale, left, top):
+            if len(coords) <= 2:
+                continue
+            draw.line(coords, width=line_width, fill=fill)
+            if path_width > 4:
+                # round joints and caps
+                for x, y in zip(coords[0::2], coords[1::2]):
+                    draw.pieslice([x - r, y - r, x + r, y + r], 0, 360, outline=fill, fill=fill)
+        if mask is None:
             return
+        if scale != 1:
+            source_box = (x0 * scale - left, y0 * scale - top, x1 * scale - left, y1 * scale - top)
+            mask = mask.resize((x1 - x0, y1 - y0), resample=Image.BOX, box=source_box)
+        if use_transparency:
+            mask = mask.point([round(v * color[3] / 255) for v in range(256)])
+        layer = Image.new("RGBA", mask.size, tuple(color[:3]))
+        layer.putalpha(mask)
+        image.data.alpha_composite(layer, (x0, y0))
+
+    @staticmethod
+    def __get_text__(text: str, x: float, y: float, color: Color, font_file=None, font_size=None) \
+            -> Tuple[Tuple[int, int, int, int], Callable]:
+        font = ImageFont.load_default()
+        try:
+            if font_file is not None and font_size > 0:
+                font = ImageFont.truetype(font_file, font_size)
+        except OSError:
+            _LOGGER.warning("Unable to find font file: %s", font_file)
+        except ImportError:
+            _LOGGER.warning("Unable to open font: %s", font_file)
 
         def draw_func(draw: ImageDraw):
-            for current_path in path.path:
-                if len(current_path) > 1:
-                    s = current_path[0].to_img(image.dimensions)
-                    coords = None
-                    for point in current_path[1:]:
-                        e = point.to_img(image.dimensions)
-                        sx = s.x * scale
-                        sy = s.y * scale
-                        ex = e.x * scale
-                        ey = e.y * scale
-                        draw.line([sx, sy, ex, ey], width=int(scale * path_width), fill=color)
-                        if path_width > 4:
-                            r = scale * path_width / 2
-                            if not coords:
-                                coords = [sx - r, sy - r, sx + r, sy + r]
-                                draw.pieslice(coords, 0, 360, outline=color, fill=color)
-                            coords = [ex - r, ey - r, ex + r, ey + r]
-                            draw.pieslice(coords, 0, 360, outline=color, fill=color)
-                        s = e
-
-        ImageHandler.__draw_on_new_layer__(image, draw_func, scale, ImageHandler.__use_transparency__(color))
-
-    @staticmethod
-    def __draw_text__(image: ImageData, text: str, x: float, y: float, color: Color, font_file=None, font_size=None):
-        def draw_func(draw: ImageDraw):
-            font = ImageFont.load_default()
-            try:
-                if font_file is not None and font_size > 0:
-                    font = ImageFont.truetype(font_file, font_size)
-            except OSError:
-                _LOGGER.warning("Unable to find font file: %s", font_file)
-            except ImportError:
-                _LOGGER.warning("Unable to open font: %s", font_file)
-            finally:
-                l, t, r, b = draw.textbbox((0, 0), text, font)
-                w, h = r - l, b - t
-                draw.text((x - w / 2, y - h / 2), text, font=font, fill=color)
-
-        ImageHandler.__draw_on_new_layer__(image, draw_func, 1, ImageHandler.__use_transparency__(color))
+            l, t, r, b = draw.textbbox((0, 0), text, font)
+            w, h = r - l, b - t
+            draw.text((x - w / 2, y - h / 2), text, font=font, fill=color)
+
+        # text is centered using its own bounding box, so twice its size always contains it
+        l, t, r, b = font.getbbox(text)
+        w, h = r - l + abs(l), b - t + abs(t)
+        return ImageHandler.__get_box__([x - w, y - h, x + w, y + h]), draw_func
 
     @staticmethod
     def __get_color__(name, colors: Colors, default_name: str = None) -> Color:
@@ -342,19 +471,62 @@ class ImageHandler:
         return ImageHandler.COLORS[default_name]
 
     @staticmethod
-    def __draw_on_new_layer__(image: ImageData, draw_function: Callable, scale: float = 1, use_transparency=False):
-        if scale == 1 and not use_transparency:
+    def __draw_primitives_on_new_layer__(image: ImageData, primitives: List[Tuple[Tuple[int, int, int, int], Callable]],
+                                         use_transparency=False):
+        if len(primitives) == 0:
+            return
+        ImageHandler.__convert_to_rgba__(image)
+        if not use_transparency:
             draw = ImageDraw.Draw(image.data, "RGBA")
+            for _, draw_function in primitives:
+                draw_function(draw)
+            return
+        # primitives are batched on a single layer until one of them overlaps another one
+        # (they would replace each other's pixels instead of blending)
+        layer = None
+        draw = None
+        boxes = []
+        for box, draw_function in primitives:
+            if layer is not None and any(ImageHandler.__boxes_overlap__(box, b) for b in boxes):
+                ImageHandler.__draw_layer__(image, layer, ImageHandler.__get_union_box__(boxes))
+                layer = None
+            if layer is None:
+                layer = Image.new("RGBA", image.data.size, (255, 255, 255, 0))
+                draw = ImageDraw.Draw(layer, "RGBA")
+                boxes = []
             draw_function(draw)
-        else:
-            size = [int(image.data.size[0] * scale), int(image.data.size[1] * scale)]
-            layer = Image.new("RGBA", size, (255, 255, 255, 0))
-            draw = ImageDraw.Draw(layer, "RGBA")
-            draw_function(draw)
-            if scale != 1:
-                layer = layer.resize(image.data.size, resample=Image.BOX)
-            ImageHandler.__draw_layer__(image, layer)
+            boxes.append(box)
+        ImageHandler.__draw_layer__(image, layer, ImageHandler.__get_union_box__(boxes))
+
+    @staticmethod
+    def __get_box__(coords: List[float], margin: int = 2) -> Tuple[int, int, int, int]:
+        xs = coords[0::2]
+        ys = coords[1::2]
+        return (math.floor(min(xs)) - margin, math.floor(min(ys)) - margin,
+                math.ceil(max(xs)) + margin + 1, math.ceil(max(ys)) + margin + 1)
+
+    @staticmethod
+    def __boxes_overlap__(a: Tuple[int, int, int, int], b: Tuple[int, int, int, int]) -> bool:
+        return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+    @staticmethod
+    def __get_union_box__(boxes: List[Tuple[int, int, int, int]]) -> Tuple[int, int, int, int]:
+        return min(b[0] for b in boxes), min(b[1] for b in boxes), max(b[2] for b in boxes), max(b[3] for b in boxes)
+
+    @staticmethod
+    def __draw_layer__(image: ImageData, layer: ImageType, box: Optional[Tuple[int, int, int, int]] = None):
+        ImageHandler.__convert_to_rgba__(image)
+        if layer.mode != "RGBA":
+            layer = layer.convert("RGBA")
+        if box is None:
+            image.data = Image.alpha_composite(image.data, layer)
+            return
+        width, height = image.data.size
+        box = (max(box[0], 0), max(box[1], 0), min(box[2], width), min(box[3], height))
+        if box[0] < box[2] and box[1] < box[3]:
+            image.data.alpha_composite(layer, (box[0], box[1]), box)
 
     @staticmethod
-    def __draw_layer__(image: ImageData, layer: ImageType):
-        image.data = Image.alpha_composite(image.data, layer)
+    def __convert_to_rgba__(image: ImageData):
+        if image.data.mode != "RGBA":
+            image.data = image.data.convert("RGBA")
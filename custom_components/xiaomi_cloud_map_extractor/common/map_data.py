@@ -1,18 +1,26 @@
 from __future__ import annotations
 
-from typing import Any, Callable, Dict, List, Optional, Set
+from array import array
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
 from PIL.Image import Image as ImageType
 
 from custom_components.xiaomi_cloud_map_extractor.const import *
 from custom_components.xiaomi_cloud_map_extractor.types import CalibrationPoints, ImageConfig
 
+# power of two, so measured factors of image transformations aren't additionally rounded by division
+AFFINE_TRANSFORMATION_SPAN = 2 ** 20
+
 
 class Point:
+    # geometry objects are not modified after parsing, so their attributes' representation can be cached
+    __slots__ = ("x", "y", "a", "_dict")
+
     def __init__(self, x: float, y: float, a=None):
         self.x = x
         self.y = y
         self.a = a
+        self._dict = None
 
     def __str__(self) -> str:
         if self.a is None:
@@ -26,6 +34,11 @@ class Point:
         return other is not None and self.x == other.x and self.y == other.y and self.a == other.a
 
     def as_dict(self) -> Dict[str, Any]:
+        if self._dict is None:
+            self._dict = self.__get_dict__()
+        return self._dict
+
+    def __get_dict__(self) -> Dict[str, Any]:
         if self.a is None:
             return {
                 ATTR_X: self.x,
@@ -64,12 +77,14 @@ class Point:
 
 
 class Obstacle(Point):
+    __slots__ = ("details",)
+
     def __init__(self, x: float, y: float, details: Dict[str, Any]):
         super().__init__(x, y)
         self.details = details
 
-    def as_dict(self) -> Dict[str, Any]:
-        return {**super(Obstacle, self).as_dict(), **self.details}
+    def __get_dict__(self) -> Dict[str, Any]:
+        return {**super(Obstacle, self).__get_dict__(), **self.details}
 
     def __str__(self) -> str:
         return f"({self.x}, {self.y}, details = {self.details})"
@@ -86,18 +101,50 @@ class ImageDimensions:
         self.rotation = rotation
         self.img_transformation = img_transformation
 
+    @staticmethod
+    def get_trim(width: int, height: int, image_config: ImageConfig) -> Tuple[int, int, int, int]:
+        """
+        Calculates numbers of pixels (left, right, top, bottom) trimmed from raw image of given size.
+        """
+        trim = image_config[CONF_TRIM]
+        return (int(trim[CONF_LEFT] * width / 100),
+                int(trim[CONF_RIGHT] * width / 100),
+                int(trim[CONF_TOP] * height / 100),
+                int(trim[CONF_BOTTOM] * height / 100))
+
     def to_img(self, point: Point) -> Point:
         p = self.img_transformation(point)
         return Point((p.x - self.left) * self.scale, (self.height - (p.y - self.top) - 1) * self.scale)
 
+    def get_affine_transformation(self) -> Tuple[float, float, float, float]:
+        # image transformations of all vendors only scale and shift coordinates of both axes independently,
+        # so they can be described by factors and offsets. Factors are measured over a wide span, so they aren't
+        # affected by rounding of transformed values
+        origin = self.img_transformation(Point(0, 0))
+        span = self.img_transformation(Point(AFFINE_TRANSFORMATION_SPAN, AFFINE_TRANSFORMATION_SPAN))
+        factor_x = (span.x - origin.x) / AFFINE_TRANSFORMATION_SPAN
+        factor_y = (span.y - origin.y) / AFFINE_TRANSFORMATION_SPAN
+        offset_x = (origin.x - self.left) * self.scale
+        offset_y = (self.height - (origin.y - self.top) - 1) * self.scale
+        return factor_x * self.scale, offset_x, -factor_y * self.scale, offset_y
+
+    def to_img_coords(self, coords: array, scale: float = 1, left: float = 0, top: float = 0) -> List[float]:
+        # image transformations of all vendors transform coordinates of both axes independently, so each distinct
+        # value is transformed only once, exactly as by to_img, to keep points of paths aligned with other elements
+        transformation, s = self.img_transformation, self.scale
+        xs, ys = coords[0::2], coords[1::2]
+        img_xs = {x: (transformation(Point(x, 0)).x - self.left) * s * scale - left for x in set(xs)}
+        img_ys = {y: (self.height - (transformation(Point(0, y)).y - self.top) - 1) * s * scale - top for y in set(ys)}
+        img_coords = [0.0] * len(coords)
+        img_coords[0::2] = [img_xs[x] for x in xs]
+        img_coords[1::2] = [img_ys[y] for y in ys]
+        return img_coords
+
 
 class ImageData:
     def __init__(self, size: int, top: int, left: int, height: int, width: int, image_config: ImageConfig,
                  data: ImageType, img_transformation: Callable[[Point], Point], additional_layers: dict = None):
-        trim_left = int(image_config[CONF_TRIM][CONF_LEFT] * width / 100)
-        trim_right = int(image_config[CONF_TRIM][CONF_RIGHT] * width / 100)
-        trim_top = int(image_config[CONF_TRIM][CONF_TOP] * height / 100)
-        trim_bottom = int(image_config[CONF_TRIM][CONF_BOTTOM] * height / 100)
+        trim_left, trim_right, trim_top, trim_bottom = ImageDimensions.get_trim(width, height, image_config)
         scale = image_config[CONF_SCALE]
         rotation = image_config[CONF_ROTATE]
         self.size = size
@@ -142,27 +189,103 @@ class ImageData:
 
 class Path:
     def __init__(self, point_length: Optional[int], point_size: Optional[int], angle: Optional[int],
-                 path: List[List[Point]]):
+                 path: List[array]):
         self.point_length = point_length
         self.point_size = point_size
         self.angle = angle
+        # each sub-path is stored as flat array of coordinates: [x0, y0, x1, y1, ...]
         self.path = path
+        self._dict = None
 
     def as_dict(self) -> Dict[str, Any]:
-        return {
-            ATTR_POINT_LENGTH: self.point_length,
-            ATTR_POINT_SIZE: self.point_size,
-            ATTR_ANGLE: self.angle,
-            ATTR_PATH: self.path
-        }
+        if self._dict is None:
+            self._dict = {
+                ATTR_POINT_LENGTH: self.point_length,
+                ATTR_POINT_SIZE: self.point_size,
+                ATTR_ANGLE: self.angle,
+                ATTR_PATH: [[{ATTR_X: x, ATTR_Y: y} for x, y in zip(coords[0::2], coords[1::2])]
+                            for coords in self.path]
+            }
+        return self._dict
+
+    def to_img(self, image_dimensions: ImageDimensions, scale: float = 1, left: float = 0, top: float = 0) \
+            -> List[List[float]]:
+        return [image_dimensions.to_img_coords(coords, scale, left, top) for coords in self.path]
+
+    def simplify(self, image_dimensions: ImageDimensions, tolerance: float) -> Path:
+        scale_x, _, scale_y, _ = image_dimensions.get_affine_transformation()
+        return Path(self.point_length, self.point_size, self.angle,
+                    [Path.__simplify_coords__(coords, scale_x, scale_y, tolerance) for coords in self.path])
+
+    @staticmethod
+    def __simplify_coords__(coords: array, scale_x: float, scale_y: float, tolerance: float) -> array:
+        count = len(coords) // 2
+        if count < 3:
+            return coords
+        all_xs = [x * scale_x for x in coords[0::2]]
+        all_ys = [y * scale_y for y in coords[1::2]]
+        tolerance_sq = tolerance * tolerance
+        # drop points closer than tolerance to the previously kept one
+        kept = [0]
+        xs = [all_xs[0]]
+        ys = [all_ys[0]]
+        for i in range(1, count - 1):
+            x = all_xs[i]
+            y = all_ys[i]
+            if (x - xs[-1]) ** 2 + (y - ys[-1]) ** 2 > tolerance_sq:
+                kept.append(i)
+                xs.append(x)
+                ys.append(y)
+        kept.append(count - 1)
+        xs.append(all_xs[-1])
+        ys.append(all_ys[-1])
+        # Douglas-Peucker on remaining points
+        markers = [False] * len(kept)
+        markers[0] = markers[-1] = True
+        ranges = [(0, len(kept) - 1)]
+        while len(ranges) > 0:
+            first, last_index = ranges.pop()
+            ax, ay = xs[first], ys[first]
+            dx, dy = xs[last_index] - ax, ys[last_index] - ay
+            length_sq = dx * dx + dy * dy
+            max_distance_sq = tolerance_sq
+            index = None
+            for i in range(first + 1, last_index):
+                px, py = xs[i] - ax, ys[i] - ay
+                if length_sq == 0:
+                    distance_sq = px * px + py * py
+                else:
+                    t = (px * dx + py * dy) / length_sq
+                    if t < 0:
+                        t = 0
+                    elif t > 1:
+                        t = 1
+                    px, py = px - t * dx, py - t * dy
+                    distance_sq = px * px + py * py
+                if distance_sq > max_distance_sq:
+                    index = i
+                    max_distance_sq = distance_sq
+            if index is not None:
+                markers[index] = True
+                ranges.append((first, index))
+                ranges.append((index, last_index))
+        simplified = array(coords.typecode)
+        for i in range(len(kept)):
+            if markers[i]:
+                simplified.append(coords[2 * kept[i]])
+                simplified.append(coords[2 * kept[i] + 1])
+        return simplified
 
 
 class Zone:
+    __slots__ = ("x0", "y0", "x1", "y1", "_dict")
+
     def __init__(self, x0: float, y0: float, x1: float, y1: float):
         self.x0 = x0
         self.y0 = y0
         self.x1 = x1
         self.y1 = y1
+        self._dict = None
 
     def __str__(self) -> str:
         return f"[{self.x0}, {self.y0}, {self.x1}, {self.y1}]"
@@ -171,6 +294,11 @@ class Zone:
         return self.__str__()
 
     def as_dict(self) -> Dict[str, Any]:
+        if self._dict is None:
+            self._dict = self.__get_dict__()
+        return self._dict
+
+    def __get_dict__(self) -> Dict[str, Any]:
         return {
             ATTR_X0: self.x0,
             ATTR_Y0: self.y0,
@@ -183,6 +311,8 @@ class Zone:
 
 
 class Room(Zone):
+    __slots__ = ("number", "name", "pos_x", "pos_y")
+
     def __init__(self, number: int, x0: Optional[float], y0: Optional[float], x1: Optional[float], y1: Optional[float],
                  name: str = None, pos_x: float = None, pos_y: float = None):
         super().__init__(x0, y0, x1, y1)
@@ -191,8 +321,8 @@ class Room(Zone):
         self.pos_x = pos_x
         self.pos_y = pos_y
 
-    def as_dict(self) -> Dict[str, Any]:
-        super_dict = {**super(Room, self).as_dict()}
+    def __get_dict__(self) -> Dict[str, Any]:
+        super_dict = super(Room, self).__get_dict__()
         if self.name is not None:
             super_dict[ATTR_NAME] = self.name
         if self.pos_x is not None:
@@ -214,11 +344,14 @@ class Room(Zone):
 
 
 class Wall:
+    __slots__ = ("x0", "y0", "x1", "y1", "_dict")
+
     def __init__(self, x0: float, y0: float, x1: float, y1: float):
         self.x0 = x0
         self.y0 = y0
         self.x1 = x1
         self.y1 = y1
+        self._dict = None
 
     def __str__(self) -> str:
         return f"[{self.x0}, {self.y0}, {self.x1}, {self.y1}]"
@@ -227,12 +360,14 @@ class Wall:
         return self.__str__()
 
     def as_dict(self) -> Dict[str, Any]:
-        return {
-            ATTR_X0: self.x0,
-            ATTR_Y0: self.y0,
-            ATTR_X1: self.x1,
-            ATTR_Y1: self.y1
-        }
+        if self._dict is None:
+            self._dict = {
+                ATTR_X0: self.x0,
+                ATTR_Y0: self.y0,
+                ATTR_X1: self.x1,
+                ATTR_Y1: self.y1
+            }
+        return self._dict
 
     def to_img(self, image_dimensions) -> Wall:
         p0 = Point(self.x0, self.y0).to_img(image_dimensions)
@@ -244,6 +379,8 @@ class Wall:
 
 
 class Area:
+    __slots__ = ("x0", "y0", "x1", "y1", "x2", "y2", "x3", "y3", "_dict")
+
     def __init__(self, x0: float, y0: float, x1: float, y1: float, x2: float, y2: float, x3: float, y3: float):
         self.x0 = x0
         self.y0 = y0
@@ -253,6 +390,7 @@ class Area:
         self.y2 = y2
         self.x3 = x3
         self.y3 = y3
+        self._dict = None
 
     def __str__(self) -> str:
         return f"[{self.x0}, {self.y0}, {self.x1}, {self.y1}, {self.x2}, {self.y2}, {self.x3}, {self.y3}]"
@@ -261,16 +399,18 @@ class Area:
         return self.__str__()
 
     def as_dict(self) -> Dict[str, Any]:
-        return {
-            ATTR_X0: self.x0,
-            ATTR_Y0: self.y0,
-            ATTR_X1: self.x1,
-            ATTR_Y1: self.y1,
-            ATTR_X2: self.x2,
-            ATTR_Y2: self.y2,
-            ATTR_X3: self.x3,
-            ATTR_Y3: self.y3
-        }
+        if self._dict is None:
+            self._dict = {
+                ATTR_X0: self.x0,
+                ATTR_Y0: self.y0,
+                ATTR_X1: self.x1,
+                ATTR_Y1: self.y1,
+                ATTR_X2: self.x2,
+                ATTR_Y2: self.y2,
+                ATTR_X3: self.x3,
+                ATTR_Y3: self.y3
+            }
+        return self._dict
 
     def as_list(self) -> List[float]:
         return [self.x0, self.y0, self.x1, self.y1, self.x2, self.y2, self.x3, self.y3]
@@ -285,6 +425,7 @@ class Area:
 
 class MapData:
     def __init__(self, calibration_center: float = 0, calibration_diff: float = 0):
+        self._lazy_fields: Dict[str, Callable[[], Any]] = {}
         self._calibration_center = calibration_center
         self._calibration_diff = calibration_diff
         self.blocks = None
@@ -295,7 +436,8 @@ class MapData:
         self.no_go_areas: Optional[List[Area]] = None
         self.no_mopping_areas: Optional[List[Area]] = None
         self.no_carpet_areas: Optional[List[Area]] = None
-        self.carpet_map: Optional[Set[int]] = []
+        self.carpet_mask: Optional[bytes] = None
+        self.carpet_map: Optional[List[List[int]]] = []
         self.obstacles: Optional[List[Obstacle]] = None
         self.ignored_obstacles: Optional[List[Obstacle]] = None
         self.obstacles_with_photo: Optional[List[Obstacle]] = None
@@ -312,6 +454,30 @@ class MapData:
         self.cleaned_rooms: Optional[Set[int]] = None
         self.map_name: Optional[str] = None
 
+    def __getattr__(self, name: str) -> Any:
+        # called only for fields without value, i.e. the ones registered with set_lazy_field
+        lazy_fields = self.__dict__.get("_lazy_fields", {})
+        if name not in lazy_fields:
+            raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+        value = lazy_fields.pop(name)()
+        setattr(self, name, value)
+        return value
+
+    def set_lazy_field(self, name: str, loader: Callable[[], Any]):
+        """
+        Defers computation of a field until its first access.
+        """
+        self.__dict__.pop(name, None)
+        self._lazy_fields[name] = loader
+
+    def discard_lazy_fields(self):
+        """
+        Sets fields that haven't been computed yet to None, releasing data referenced by their loaders.
+        """
+        for name in self._lazy_fields:
+            setattr(self, name, None)
+        self._lazy_fields.clear()
+
     def calibration(self) -> Optional[CalibrationPoints]:
         if self.image.is_empty:
             return None
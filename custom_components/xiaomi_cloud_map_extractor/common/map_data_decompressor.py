@@ -0,0 +1,61 @@
+import zlib
+from typing import Tuple
+
+
+class MapDataDecompressor:
+    """
+    Decompresses raw map data in small pieces directly into a single output buffer, so no intermediate buffers of
+    one-shot decompression are created. Whole compressed data still has to be kept in memory.
+    """
+    INPUT_CHUNK_SIZE = 16 * 1024
+    OUTPUT_CHUNK_SIZE = 64 * 1024
+    # size stored in gzip trailer is not trusted beyond this multiple of compressed data size
+    MAX_SIZE_HINT_RATIO = 64
+
+    @staticmethod
+    def gunzip(data: bytes) -> bytearray:
+        # size of decompressed data (modulo 2^32) is stored in the last 4 bytes of gzip stream
+        size = int.from_bytes(data[-4:], byteorder="little") if len(data) >= 4 else 0
+        output = bytearray(min(size, len(data) * MapDataDecompressor.MAX_SIZE_HINT_RATIO))
+        size = 0
+        pending = memoryview(data)
+        # gzip stream can consist of multiple members, optionally followed by zero padding
+        while len(pending) > 0:
+            size, unused_data = MapDataDecompressor.decompress(pending, 16 + zlib.MAX_WBITS, output, size)
+            pending = memoryview(unused_data.lstrip(b"\x00"))
+        del output[size:]
+        return output
+
+    @staticmethod
+    def inflate(data: bytes) -> bytearray:
+        output = bytearray()
+        try:
+            # data after the end of zlib stream is ignored
+            size, _ = MapDataDecompressor.decompress(memoryview(data), zlib.MAX_WBITS, output, 0)
+        except EOFError as e:
+            raise zlib.error("Error -5 while decompressing data: incomplete or truncated stream") from e
+        del output[size:]
+        return output
+
+    @staticmethod
+    def decompress(data: memoryview, wbits: int, output: bytearray, size: int) -> Tuple[int, bytes]:
+        """
+        Decompresses a single stream, writing it to output starting at given size.
+        Returns new size of output and data that remained after the end of the stream.
+        """
+        decompressor = zlib.decompressobj(wbits)
+        pending = data
+        while len(pending) > 0 and not decompressor.eof:
+            piece = pending[:MapDataDecompressor.INPUT_CHUNK_SIZE]
+            pending = pending[MapDataDecompressor.INPUT_CHUNK_SIZE:]
+            while True:
+                chunk = decompressor.decompress(piece, MapDataDecompressor.OUTPUT_CHUNK_SIZE)
+                output[size:size + len(chunk)] = chunk
+                size += len(chunk)
+                piece = decompressor.unconsumed_tail
+                # full chunk means that more output may be pending even if whole piece was consumed
+                if len(piece) == 0 and len(chunk) < MapDataDecompressor.OUTPUT_CHUNK_SIZE:
+                    break
+        if not decompressor.eof:
+            raise EOFError("compressed map data ended before the end-of-stream marker was reached")
+        return size, decompressor.unused_data + pending
@@ -1,14 +1,36 @@
+import hashlib
 import logging
+import threading
+from typing import Dict, Optional
+
+from PIL.Image import Image as ImageType
 
 from custom_components.xiaomi_cloud_map_extractor.common.image_handler import ImageHandler
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import ImageData, MapData
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.const import *
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, ImageConfig, Sizes, Texts
 
 _LOGGER = logging.getLogger(__name__)
 
+STATIC_LAYER_CACHE_SIZE = 4
+STATIC_DRAWABLE_FIELDS = {
+    DRAWABLE_CHARGER: "charger",
+    DRAWABLE_OBSTACLES: "obstacles",
+    DRAWABLE_IGNORED_OBSTACLES: "ignored_obstacles",
+    DRAWABLE_OBSTACLES_WITH_PHOTO: "obstacles_with_photo",
+    DRAWABLE_IGNORED_OBSTACLES_WITH_PHOTO: "ignored_obstacles_with_photo",
+    DRAWABLE_NO_CARPET_AREAS: "no_carpet_areas",
+    DRAWABLE_NO_GO_AREAS: "no_go_areas",
+    DRAWABLE_NO_MOPPING_AREAS: "no_mopping_areas",
+    DRAWABLE_VIRTUAL_WALLS: "walls",
+    DRAWABLE_ZONES: "zones",
+}
+
 
 class MapDataParser:
+    __static_layer_cache__: Dict[bytes, ImageType] = {}
+    __static_layer_cache_lock__ = threading.Lock()
 
     @staticmethod
     def create_empty(colors: Colors, text: str) -> MapData:
@@ -19,12 +41,76 @@ class MapDataParser:
 
     @staticmethod
     def parse(raw: bytes, colors: Colors, drawables: Drawables, texts: Texts, sizes: Sizes,
-              image_config: ImageConfig, *args, **kwargs) -> MapData:
+              image_config: ImageConfig, parse_plan: Optional[ParsePlan] = None, *args, **kwargs) -> MapData:
         pass
 
+    @staticmethod
+    def simplify_paths(map_data: MapData, image_config: ImageConfig):
+        tolerance = image_config.get(CONF_PATH_SIMPLIFICATION, 0)
+        if tolerance <= 0:
+            return
+        dimensions = map_data.image.dimensions
+        # mop path can be derived from points of path, so it has to be simplified (and loaded) first
+        if map_data.mop_path is not None:
+            map_data.mop_path = map_data.mop_path.simplify(dimensions, tolerance)
+        if map_data.path is not None:
+            map_data.path = map_data.path.simplify(dimensions, tolerance)
+        if map_data.goto_path is not None:
+            map_data.goto_path = map_data.goto_path.simplify(dimensions, tolerance)
+        if map_data.predicted_path is not None:
+            map_data.predicted_path = map_data.predicted_path.simplify(dimensions, tolerance)
+
     @staticmethod
     def draw_elements(colors: Colors, drawables: Drawables, sizes: Sizes, map_data: MapData, image_config: ImageConfig):
+        # only static elements placed below the first dynamic one can be cached without changing their order
+        static_count = next((i for i, d in enumerate(drawables) if d in DYNAMIC_DRAWABLES), len(drawables))
+        if static_count > 0:
+            MapDataParser.__draw_static_elements__(colors, drawables[:static_count], sizes, map_data, image_config)
+        MapDataParser.__draw_drawables__(colors, drawables[static_count:], sizes, map_data, image_config)
+
+    @staticmethod
+    def __draw_static_elements__(colors: Colors, drawables: Drawables, sizes: Sizes, map_data: MapData,
+                                 image_config: ImageConfig):
+        key = MapDataParser.__get_static_layer_key__(colors, drawables, sizes, map_data, image_config)
+        cache = MapDataParser.__static_layer_cache__
+        with MapDataParser.__static_layer_cache_lock__:
+            static_layer = cache.pop(key, None)
+            if static_layer is not None:
+                cache[key] = static_layer
+        if static_layer is None:
+            MapDataParser.__draw_drawables__(colors, drawables, sizes, map_data, image_config)
+            static_layer = map_data.image.data
+            with MapDataParser.__static_layer_cache_lock__:
+                while len(cache) >= STATIC_LAYER_CACHE_SIZE:
+                    cache.pop(next(iter(cache)))
+                cache[key] = static_layer
+        else:
+            _LOGGER.debug("Reusing cached static map layer")
+        map_data.image.data = static_layer.copy()
+
+    @staticmethod
+    def __get_static_layer_key__(colors: Colors, drawables: Drawables, sizes: Sizes, map_data: MapData,
+                                 image_config: ImageConfig) -> bytes:
+        image = map_data.image
+        digest = hashlib.sha1(image.data.tobytes())
+        for layer in image.additional_layers.values():
+            digest.update(layer.tobytes())
+        rooms = None
+        if map_data.rooms is not None:
+            rooms = {number: room.as_dict() for number, room in map_data.rooms.items()}
+        # only elements which are drawn are accessed, so lazily parsed fields stay untouched otherwise
+        elements = [getattr(map_data, STATIC_DRAWABLE_FIELDS[drawable]) for drawable in drawables
+                    if drawable in STATIC_DRAWABLE_FIELDS]
+        geometry = (image.data.mode, image.data.size, image.data.getpalette(), image.as_dict(), drawables, colors,
+                    sizes, image_config, elements, rooms)
+        digest.update(repr(geometry).encode())
+        return digest.digest()
+
+    @staticmethod
+    def __draw_drawables__(colors: Colors, drawables: Drawables, sizes: Sizes, map_data: MapData,
+                           image_config: ImageConfig):
         scale = float(image_config[CONF_SCALE])
+        path_scale = min(scale, image_config.get(CONF_PATH_SUPERSAMPLING, scale))
 
         for drawable in drawables:
             if DRAWABLE_CHARGER == drawable and map_data.charger is not None:
@@ -41,13 +127,13 @@ class MapDataParser:
                 ImageHandler.draw_ignored_obstacles_with_photo(map_data.image, map_data.ignored_obstacles_with_photo,
                                                                sizes, colors)
             if DRAWABLE_MOP_PATH == drawable and map_data.mop_path is not None:
-                ImageHandler.draw_mop_path(map_data.image, map_data.mop_path, sizes, colors, scale)
+                ImageHandler.draw_mop_path(map_data.image, map_data.mop_path, sizes, colors, path_scale)
             if DRAWABLE_PATH == drawable and map_data.path is not None:
-                ImageHandler.draw_path(map_data.image, map_data.path, sizes, colors, scale)
+                ImageHandler.draw_path(map_data.image, map_data.path, sizes, colors, path_scale)
             if DRAWABLE_GOTO_PATH == drawable and map_data.goto_path is not None:
-                ImageHandler.draw_goto_path(map_data.image, map_data.goto_path, sizes, colors, scale)
+                ImageHandler.draw_goto_path(map_data.image, map_data.goto_path, sizes, colors, path_scale)
             if DRAWABLE_PREDICTED_PATH == drawable and map_data.predicted_path is not None:
-                ImageHandler.draw_predicted_path(map_data.image, map_data.predicted_path, sizes, colors, scale)
+                ImageHandler.draw_predicted_path(map_data.image, map_data.predicted_path, sizes, colors, path_scale)
             if DRAWABLE_NO_CARPET_AREAS == drawable and map_data.no_carpet_areas is not None:
                 ImageHandler.draw_no_carpet_areas(map_data.image, map_data.no_carpet_areas, colors)
             if DRAWABLE_NO_GO_AREAS == drawable and map_data.no_go_areas is not None:
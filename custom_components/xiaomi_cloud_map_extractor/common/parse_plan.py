@@ -0,0 +1,31 @@
+from __future__ import annotations
+
+from typing import List
+
+from custom_components.xiaomi_cloud_map_extractor.const import *
+from custom_components.xiaomi_cloud_map_extractor.types import Drawables
+
+
+class ParsePlan:
+    """
+    Describes which optional parts of a map are required by configured drawables and attributes.
+    Parsers skip computation of parts that are not required.
+    """
+
+    def __init__(self, drawables: Drawables, attributes: List[str]):
+        if DRAWABLE_ALL in drawables:
+            drawables = CONF_AVAILABLE_DRAWABLES[1:]
+        self.vacuum_room = ATTRIBUTE_VACUUM_ROOM in attributes or ATTRIBUTE_VACUUM_ROOM_NAME in attributes
+        self.rooms = self.vacuum_room \
+            or DRAWABLE_ROOM_NAMES in drawables \
+            or ATTRIBUTE_ROOMS in attributes \
+            or ATTRIBUTE_ROOM_NUMBERS in attributes
+        self.cleaned_rooms = ATTRIBUTE_CLEANED_ROOMS in attributes
+        self.path = DRAWABLE_PATH in drawables \
+            or DRAWABLE_MOP_PATH in drawables \
+            or ATTRIBUTE_PATH in attributes \
+            or ATTRIBUTE_MOP_PATH in attributes
+
+    @staticmethod
+    def full() -> ParsePlan:
+        return ParsePlan(CONF_AVAILABLE_DRAWABLES, CONF_AVAILABLE_ATTRIBUTES)
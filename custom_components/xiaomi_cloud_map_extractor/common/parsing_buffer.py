@@ -6,9 +6,15 @@ _LOGGER = logging.getLogger(__name__)
 
 
 class ParsingBuffer:
+    """
+    Sequential reader of raw map data. Data is accessed through a memoryview,
+    so returned byte ranges are views of the original buffer instead of copies.
+    """
+
     def __init__(self, name: str, data: bytes, start_offs: int, length: int):
         self._name = name
-        self._data = data
+        self._raw = data
+        self._data = memoryview(data)
         self._offs = start_offs
         self._length = length
         self._image_beginning = None
@@ -20,9 +26,32 @@ class ParsingBuffer:
     def mark_as_image_beginning(self):
         self._image_beginning = self._offs
 
+    @property
+    def offset(self) -> int:
+        return self._offs
+
+    @property
+    def remaining(self) -> int:
+        return self._length
+
     def get_at_image(self, offset) -> int:
         return self._data[self._image_beginning + offset - 1]
 
+    def get_at(self, offset: int, n: int) -> memoryview:
+        return self._data[offset:offset + n]
+
+    def find(self, sub: bytes) -> int:
+        n = self._raw.find(sub, self._offs, self._offs + self._length)
+        return n - self._offs if n >= 0 else n
+
+    def skip_to(self, field: str, sub: bytes) -> bool:
+        n = self.find(sub)
+        if n < 0:
+            self.skip(field, self._length)
+            return False
+        self.skip(field, n)
+        return True
+
     def skip(self, field: str, n: int):
         if self._length < n:
             raise ValueError(f"error parsing {self._name}.{field} at offset {self._offs:#x}: buffer underrun")
@@ -57,19 +86,29 @@ class ParsingBuffer:
         self._length -= 4
         return unpack_from('<f', self._data, self._offs - 4)[0]
 
+    def get_bytes(self, field: str, n: int) -> memoryview:
+        if self._length < n:
+            raise ValueError(f"error parsing {self._name}.{field} at offset {self._offs:#x}: buffer underrun")
+        self._offs += n
+        self._length -= n
+        return self._data[self._offs - n:self._offs]
+
     def get_string_len8(self, field: str) -> str:
         n = self.get_uint8(field + '.len')
         if self._length < n:
             raise ValueError(f"error parsing {self._name}.{field} at offset {self._offs:#x}: buffer underrun")
         self._offs += n
         self._length -= n
-        return self._data[self._offs - n:self._offs].decode('UTF-8')
+        return str(self._data[self._offs - n:self._offs], 'UTF-8')
 
     def peek_uint32(self, field: str) -> int:
         if self._length < 4:
             raise ValueError(f"error parsing {self._name}.{field} at offset {self._offs:#x}: buffer underrun")
         return unpack_from('<L', self._data, self._offs)[0]
 
+    def get_remaining_bytes(self, field: str) -> memoryview:
+        return self.get_bytes(field, self._length)
+
     def check_empty(self):
         if self._length == 0:
             _LOGGER.debug('all of the data has been processed')
@@ -1,8 +1,10 @@
+import hashlib
 from abc import abstractmethod
 from typing import Optional, Tuple
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import MapData
 from custom_components.xiaomi_cloud_map_extractor.common.map_data_parser import MapDataParser
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.common.xiaomi_cloud_connector import XiaomiCloudConnector
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, ImageConfig, Sizes, Texts
 
@@ -15,16 +17,29 @@ class XiaomiCloudVacuum:
         self._user_id = user_id
         self._device_id = device_id
         self.model = model
+        self.map_cache_hits = 0
+        self.map_cache_misses = 0
+        self._cached_map_digest = None
+        self._cached_map_data = None
 
-    def get_map(self,
-                map_name: str,
-                colors: Colors,
-                drawables: Drawables,
-                texts: Texts,
-                sizes: Sizes,
-                image_config: ImageConfig,
-                store_map_path: Optional[str] = None) -> Tuple[Optional[MapData], bool]:
-        response = self.get_raw_map_data(map_name)
+    @property
+    def user_id(self) -> str:
+        return self._user_id
+
+    @property
+    def device_id(self) -> str:
+        return self._device_id
+
+    def get_map_from_raw_data(self,
+                              map_name: str,
+                              response: Optional[bytes],
+                              colors: Colors,
+                              drawables: Drawables,
+                              texts: Texts,
+                              sizes: Sizes,
+                              image_config: ImageConfig,
+                              store_map_path: Optional[str] = None,
+                              parse_plan: Optional[ParsePlan] = None) -> Tuple[Optional[MapData], bool]:
         if response is None:
             return None, False
         map_stored = False
@@ -33,17 +48,25 @@ class XiaomiCloudVacuum:
             raw_map_file.write(response)
             raw_map_file.close()
             map_stored = True
-        map_data = self.decode_map(response, colors, drawables, texts, sizes, image_config)
+        map_digest = hashlib.sha1(response).digest()
+        if map_digest == self._cached_map_digest and map_name == self._cached_map_data.map_name:
+            # map hasn't changed since last retrieval, it doesn't have to be decoded and drawn again
+            self.map_cache_hits = self.map_cache_hits + 1
+            return self._cached_map_data, map_stored
+        self.map_cache_misses = self.map_cache_misses + 1
+        map_data = self.decode_map(response, colors, drawables, texts, sizes, image_config, parse_plan)
         if map_data is None:
             return None, map_stored
         map_data.map_name = map_name
+        self._cached_map_digest = map_digest
+        self._cached_map_data = map_data
         return map_data, map_stored
 
-    def get_raw_map_data(self, map_name: Optional[str]) -> Optional[bytes]:
+    async def async_get_raw_map_data(self, map_name: Optional[str]) -> Optional[bytes]:
         if map_name is None:
             return None
-        map_url = self.get_map_url(map_name)
-        return self._connector.get_raw_map_data(map_url)
+        map_url = await self.async_get_map_url(map_name)
+        return await self._connector.async_get_raw_map_data(map_url)
 
     def decode_map(self,
                    raw_map: bytes,
@@ -51,11 +74,12 @@ class XiaomiCloudVacuum:
                    drawables: Drawables,
                    texts: Texts,
                    sizes: Sizes,
-                   image_config: ImageConfig) -> Optional[MapData]:
+                   image_config: ImageConfig,
+                   parse_plan: Optional[ParsePlan] = None) -> Optional[MapData]:
         return MapDataParser.create_empty(colors, f"Vacuum\n{self.model}\nis not supported")
 
     @abstractmethod
-    def get_map_url(self, map_name: str) -> Optional[str]:
+    async def async_get_map_url(self, map_name: str) -> Optional[str]:
         pass
 
     @abstractmethod
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import Any, Dict, Optional
 
 from custom_components.xiaomi_cloud_map_extractor.common.vacuum import XiaomiCloudVacuum
 from custom_components.xiaomi_cloud_map_extractor.common.xiaomi_cloud_connector import XiaomiCloudConnector
@@ -9,12 +9,19 @@ class XiaomiCloudVacuumV2(XiaomiCloudVacuum):
     def __init__(self, connector: XiaomiCloudConnector, country: str, user_id: str, device_id: str, model: str):
         super().__init__(connector, country, user_id, device_id, model)
 
-    def get_map_url(self, map_name: str) -> Optional[str]:
+    async def async_get_map_url(self, map_name: str) -> Optional[str]:
         url = self._connector.get_api_url(self._country) + '/v2/home/get_interim_file_url'
-        params = {
+        api_response = await self._connector.async_execute_api_call_encrypted(url,
+                                                                              self.__get_map_url_params__(map_name))
+        return self.__get_map_url_from_response__(api_response)
+
+    def __get_map_url_params__(self, map_name: str) -> Dict[str, str]:
+        return {
             "data": f'{{"obj_name":"{self._user_id}/{self._device_id}/{map_name}"}}'
         }
-        api_response = self._connector.execute_api_call_encrypted(url, params)
+
+    @staticmethod
+    def __get_map_url_from_response__(api_response: Any) -> Optional[str]:
         if api_response is None or "result" not in api_response or "url" not in api_response["result"]:
             return None
         return api_response["result"]["url"]
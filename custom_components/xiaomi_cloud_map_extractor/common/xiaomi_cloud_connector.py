@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import hmac
@@ -6,15 +7,24 @@ import logging
 import os
 import random
 import time
-from typing import Any, Dict, NamedTuple, Optional, Tuple
+from http.cookies import SimpleCookie
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple, TypeVar
 from Crypto.Cipher import ARC4
 
-import requests
+import aiohttp
+from yarl import URL
 
 from custom_components.xiaomi_cloud_map_extractor.const import *
 
 _LOGGER = logging.getLogger(__name__)
 
+LOGIN_STEP_1_URL = "https://account.xiaomi.com/pass/serviceLogin?sid=xiaomiio&_json=true"
+LOGIN_STEP_2_URL = "https://account.xiaomi.com/pass/serviceLoginAuth2"
+ASYNC_TIMEOUT = aiohttp.ClientTimeout(total=10)
+REQUIRED_SESSION_KEYS = ["agent", "device_id", "ssecurity", "user_id", "service_token"]
+
+T = TypeVar("T")
+
 
 class XiaomiHome(NamedTuple):
     homeid: int
@@ -34,13 +44,13 @@ class XiaomiDeviceInfo(NamedTuple):
 # noinspection PyBroadException
 class XiaomiCloudConnector:
 
-    def __init__(self, username: str, password: str):
+    def __init__(self, username: str, password: str, async_session: Optional[aiohttp.ClientSession] = None):
         self.two_factor_auth_url = None
         self._username = username
         self._password = password
         self._agent = self.generate_agent()
         self._device_id = self.generate_device_id()
-        self._session = requests.session()
+        self._async_session = async_session
         self._sign = None
         self._ssecurity = None
         self._userId = None
@@ -50,31 +60,243 @@ class XiaomiCloudConnector:
         self._code = None
         self._serviceToken = None
 
-    def login_step_1(self) -> bool:
-        url = "https://account.xiaomi.com/pass/serviceLogin?sid=xiaomiio&_json=true"
-        headers = {
+    async def async_login_step_1(self) -> bool:
+        try:
+            async with self.__get_async_session__().get(LOGIN_STEP_1_URL, headers=self.__get_login_headers__(),
+                                                        cookies=self.__get_login_step_1_cookies__(),
+                                                        timeout=ASYNC_TIMEOUT) as response:
+                status, text = response.status, await response.text()
+        except Exception:
+            status, text = None, None
+        return self.__handle_login_step_1__(status, text)
+
+    async def async_login_step_2(self) -> bool:
+        try:
+            async with self.__get_async_session__().post(LOGIN_STEP_2_URL, headers=self.__get_login_headers__(),
+                                                         params=self.__get_login_step_2_fields__(),
+                                                         timeout=ASYNC_TIMEOUT) as response:
+                status, text = response.status, await response.text()
+        except Exception:
+            status, text = None, None
+        return self.__handle_login_step_2__(status, text)
+
+    async def async_login_step_3(self) -> bool:
+        try:
+            async with self.__get_async_session__().get(self._location, headers=self.__get_login_headers__(),
+                                                        timeout=ASYNC_TIMEOUT) as response:
+                status = response.status
+                service_token = response.cookies["serviceToken"].value if "serviceToken" in response.cookies else None
+        except Exception:
+            status, service_token = None, None
+        return self.__handle_login_step_3__(status, service_token)
+
+    async def async_login(self) -> bool:
+        session = self.__get_async_session__()
+        session.cookie_jar.clear()
+        self._agent = self.generate_agent()
+        self._device_id = self.generate_device_id()
+        for domain in ["mi.com", "xiaomi.com"]:
+            cookies = SimpleCookie(self.__get_login_session_cookies__())
+            for cookie in cookies.values():
+                cookie["domain"] = domain
+            session.cookie_jar.update_cookies(cookies, URL(f"https://{domain}"))
+        return await self.async_login_step_1() and await self.async_login_step_2() and await self.async_login_step_3()
+
+    def get_session_data(self) -> Dict[str, Any]:
+        return {
+            "agent": self._agent,
+            "device_id": self._device_id,
+            "ssecurity": self._ssecurity,
+            "user_id": self._userId,
+            "c_user_id": self._cUserId,
+            "service_token": self._serviceToken
+        }
+
+    def restore_session_data(self, session_data: Dict[str, Any]) -> bool:
+        """
+        Restores session created by a previous login. Session is not validated, so it has to be replaced by a new
+        login after a failing API call.
+        """
+        if any(session_data.get(key) is None for key in REQUIRED_SESSION_KEYS):
+            return False
+        self._agent = session_data["agent"]
+        self._device_id = session_data["device_id"]
+        self._ssecurity = session_data["ssecurity"]
+        self._userId = session_data["user_id"]
+        self._cUserId = session_data.get("c_user_id")
+        self._serviceToken = session_data["service_token"]
+        return True
+
+    async def async_get_raw_map_data(self, map_url) -> Optional[bytes]:
+        if map_url is not None:
+            try:
+                async with self.__get_async_session__().get(map_url, timeout=ASYNC_TIMEOUT) as response:
+                    if response.status == 200:
+                        return await response.read()
+            except Exception:
+                pass
+        return None
+
+    async def async_get_homes(self, country: str) -> List[XiaomiHome]:
+        url = self.get_api_url(country) + "/v2/homeroom/gethome"
+        if (response := await self.async_execute_api_call_encrypted(url, self.__get_homes_params__())) is None:
+            return []
+        return list(self.__parse_homes__(response))
+
+    async def async_get_devices_from_home(self, country: str, home_id: int, owner_id: int) -> List[XiaomiDeviceInfo]:
+        url = self.get_api_url(country) + "/v2/home/home_device_list"
+        params = self.__get_devices_from_home_params__(home_id, owner_id)
+        if (response := await self.async_execute_api_call_encrypted(url, params)) is None:
+            return []
+        return list(self.__parse_devices_from_home__(response, country, home_id, owner_id))
+
+    async def async_get_device_details_from_home(self, token: str, country: Optional[str] = None):
+        countries_to_check = CONF_AVAILABLE_COUNTRIES if country is None else [country]
+        found = await self.__async_get_first_result__(
+            self.__async_find_device_in_homes__(token, c) for c in countries_to_check)
+        if found is not None:
+            return found
+
+        return None, None, None, None
+
+    async def async_get_device_details(self, token: str, country: Optional[str]) \
+            -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+        countries_to_check = CONF_AVAILABLE_COUNTRIES
+        if country is not None:
+            countries_to_check = [country]
+        found = await self.__async_get_first_result__(
+            self.__async_find_device_in_country__(token, c) for c in countries_to_check)
+        if found is not None:
+            return found
+        return await self.async_get_device_details_from_home(token, country)
+
+    async def async_get_devices(self, country: str) -> Any:
+        url = self.get_api_url(country) + "/home/device_list"
+        return await self.async_execute_api_call_encrypted(url, self.__get_devices_params__())
+
+    async def async_execute_api_call_encrypted(self, url: str, params: Dict[str, str]) -> Any:
+        headers, cookies, fields = self.__prepare_api_call__(url, params)
+        try:
+            async with self.__get_async_session__().post(url, headers=headers, cookies=cookies, params=fields,
+                                                         timeout=ASYNC_TIMEOUT) as response:
+                status, text = response.status, await response.text()
+        except Exception:
+            status, text = None, None
+        return self.__handle_api_call_response__(status, text, fields)
+
+    # Synchronous API is kept for external callers. Each call runs its async counterpart in a new event loop,
+    # so it can't be used from a running event loop.
+
+    def login(self) -> bool:
+        return self.__run_sync__(self.async_login)
+
+    def get_raw_map_data(self, map_url) -> Optional[bytes]:
+        return self.__run_sync__(self.async_get_raw_map_data, map_url)
+
+    def get_homes_iter(self, country: str) -> Iterator[XiaomiHome]:
+        return iter(self.__run_sync__(self.async_get_homes, country))
+
+    def get_devices_from_home_iter(self, country: str, home_id: int, owner_id: int) -> Iterator[XiaomiDeviceInfo]:
+        return iter(self.__run_sync__(self.async_get_devices_from_home, country, home_id, owner_id))
+
+    def get_devices_iter(self, country: Optional[str] = None) -> Iterator[XiaomiDeviceInfo]:
+        countries_to_check = CONF_AVAILABLE_COUNTRIES if country is None else [country]
+        for _country in countries_to_check:
+            for home in self.get_homes_iter(_country):
+                yield from self.get_devices_from_home_iter(_country, home.homeid, home.owner)
+
+    def get_device_details_from_home(self, token: str, country: Optional[str] = None):
+        return self.__run_sync__(self.async_get_device_details_from_home, token, country)
+
+    def get_device_details(self, token: str,
+                           country: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
+        return self.__run_sync__(self.async_get_device_details, token, country)
+
+    def get_devices(self, country: str) -> Any:
+        return self.__run_sync__(self.async_get_devices, country)
+
+    def execute_api_call_encrypted(self, url: str, params: Dict[str, str]) -> Any:
+        return self.__run_sync__(self.async_execute_api_call_encrypted, url, params)
+
+    def __run_sync__(self, coroutine_function: Callable[..., Awaitable[T]], *args) -> T:
+        return asyncio.run(self.__async_run_with_own_session__(coroutine_function, *args))
+
+    async def __async_run_with_own_session__(self, coroutine_function: Callable[..., Awaitable[T]], *args) -> T:
+        # aiohttp session is bound to the event loop it was created in, so a temporary one is used
+        async_session = self._async_session
+        async with aiohttp.ClientSession() as session:
+            self._async_session = session
+            try:
+                return await coroutine_function(*args)
+            finally:
+                self._async_session = async_session
+
+    async def __async_find_device_in_country__(self, token: str, country: str) \
+            -> Optional[Tuple[str, str, str, str]]:
+        devices = await self.async_get_devices(country)
+        if (found := self.__find_device__(devices, token)) is not None:
+            return (country, *found)
+        return None
+
+    async def __async_find_device_in_homes__(self, token: str, country: str) \
+            -> Optional[Tuple[str, str, str, str]]:
+        homes = await self.async_get_homes(country)
+        return await self.__async_get_first_result__(
+            self.__async_find_device_in_home__(token, country, home) for home in homes)
+
+    async def __async_find_device_in_home__(self, token: str, country: str, home: XiaomiHome) \
+            -> Optional[Tuple[str, str, str, str]]:
+        for device in await self.async_get_devices_from_home(country, home.homeid, home.owner):
+            if device.token == token:
+                return device.country, device.user_id, device.device_id, device.model
+        return None
+
+    @staticmethod
+    async def __async_get_first_result__(coroutines: Iterable[Awaitable[Optional[T]]]) -> Optional[T]:
+        """
+        Runs all coroutines concurrently and returns the first result that is not None.
+        Coroutines that are still running at that moment are cancelled.
+        """
+        tasks = [asyncio.ensure_future(coroutine) for coroutine in coroutines]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                if (result := await next_done) is not None:
+                    return result
+            return None
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def __get_async_session__(self) -> aiohttp.ClientSession:
+        if self._async_session is None:
+            self._async_session = aiohttp.ClientSession()
+        return self._async_session
+
+    def __get_login_headers__(self) -> Dict[str, str]:
+        return {
             "User-Agent": self._agent,
             "Content-Type": "application/x-www-form-urlencoded"
         }
-        cookies = {
+
+    def __get_login_session_cookies__(self) -> Dict[str, str]:
+        return {
+            "sdkVersion": "accountsdk-18.8.15",
+            "deviceId": self._device_id
+        }
+
+    def __get_login_step_1_cookies__(self) -> Dict[str, str]:
+        return {
             "userId": self._username
         }
-        try:
-            response = self._session.get(url, headers=headers, cookies=cookies, timeout=10)
-        except:
-            response = None
-        successful = response is not None and response.status_code == 200 and "_sign" in self.to_json(response.text)
+
+    def __handle_login_step_1__(self, status: Optional[int], text: Optional[str]) -> bool:
+        successful = status == 200 and "_sign" in self.to_json(text)
         if successful:
-            self._sign = self.to_json(response.text)["_sign"]
+            self._sign = self.to_json(text)["_sign"]
         return successful
 
-    def login_step_2(self) -> bool:
-        url = "https://account.xiaomi.com/pass/serviceLoginAuth2"
-        headers = {
-            "User-Agent": self._agent,
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        fields = {
+    def __get_login_step_2_fields__(self) -> Dict[str, str]:
+        return {
             "sid": "xiaomiio",
             "hash": hashlib.md5(str.encode(self._password)).hexdigest().upper(),
             "callback": "https://sts.api.io.mi.com/sts",
@@ -83,13 +305,11 @@ class XiaomiCloudConnector:
             "_sign": self._sign,
             "_json": "true"
         }
-        try:
-            response = self._session.post(url, headers=headers, params=fields, timeout=10)
-        except:
-            response = None
-        successful = response is not None and response.status_code == 200
+
+    def __handle_login_step_2__(self, status: Optional[int], text: Optional[str]) -> Optional[bool]:
+        successful = status == 200
         if successful:
-            json_resp = self.to_json(response.text)
+            json_resp = self.to_json(text)
             successful = "ssecurity" in json_resp and len(str(json_resp["ssecurity"])) > 4
             if successful:
                 self._ssecurity = json_resp["ssecurity"]
@@ -111,44 +331,15 @@ class XiaomiCloudConnector:
 
         return successful
 
-    def login_step_3(self) -> bool:
-        headers = {
-            "User-Agent": self._agent,
-            "Content-Type": "application/x-www-form-urlencoded"
-        }
-        try:
-            response = self._session.get(self._location, headers=headers, timeout=10)
-        except:
-            response = None
-        successful = response is not None and response.status_code == 200 and "serviceToken" in response.cookies
+    def __handle_login_step_3__(self, status: Optional[int], service_token: Optional[str]) -> bool:
+        successful = status == 200 and service_token is not None
         if successful:
-            self._serviceToken = response.cookies.get("serviceToken")
+            self._serviceToken = service_token
         return successful
 
-    def login(self) -> bool:
-        self._session.close()
-        self._session = requests.session()
-        self._agent = self.generate_agent()
-        self._device_id = self.generate_device_id()
-        self._session.cookies.set("sdkVersion", "accountsdk-18.8.15", domain="mi.com")
-        self._session.cookies.set("sdkVersion", "accountsdk-18.8.15", domain="xiaomi.com")
-        self._session.cookies.set("deviceId", self._device_id, domain="mi.com")
-        self._session.cookies.set("deviceId", self._device_id, domain="xiaomi.com")
-        return self.login_step_1() and self.login_step_2() and self.login_step_3()
-
-    def get_raw_map_data(self, map_url) -> Optional[bytes]:
-        if map_url is not None:
-            try:
-                response = self._session.get(map_url, timeout=10)
-            except:
-                response = None
-            if response is not None and response.status_code == 200:
-                return response.content
-        return None
-
-    def get_homes_iter(self, country: str):
-        url = self.get_api_url(country) + "/v2/homeroom/gethome"
-        params = {
+    @staticmethod
+    def __get_homes_params__() -> Dict[str, str]:
+        return {
             "data": json.dumps(
                 {
                     "fg": True,
@@ -160,18 +351,17 @@ class XiaomiCloudConnector:
             )
         }
 
-        if (response := self.execute_api_call_encrypted(url, params)) is None:
-            return None
-
+    @staticmethod
+    def __parse_homes__(response: Any):
         if homelist := response["result"]["homelist"]:
             yield from (XiaomiHome(int(home["id"]), home["uid"]) for home in homelist)
 
         if homelist := response["result"]["share_home_list"]:
             yield from (XiaomiHome(int(home["id"]), home["uid"]) for home in homelist)
 
-    def get_devices_from_home_iter(self, country: str, home_id: int, owner_id: int):
-        url = self.get_api_url(country) + "/v2/home/home_device_list"
-        params = {
+    @staticmethod
+    def __get_devices_from_home_params__(home_id: int, owner_id: int) -> Dict[str, str]:
+        return {
             "data": json.dumps(
                 {
                     "home_id": home_id,
@@ -182,9 +372,9 @@ class XiaomiCloudConnector:
                 }
             )
         }
-        if (response := self.execute_api_call_encrypted(url, params)) is None:
-            return
 
+    @staticmethod
+    def __parse_devices_from_home__(response: Any, country: str, home_id: int, owner_id: int):
         if (raw_devices := response["result"]["device_info"]) is None:
             return
 
@@ -201,50 +391,24 @@ class XiaomiCloudConnector:
             for device in raw_devices
         )
 
-    def get_devices_iter(self, country: Optional[str] = None):
-        countries_to_check = CONF_AVAILABLE_COUNTRIES if country is None else [country]
-        for _country in countries_to_check:
-            homes = self.get_homes_iter(_country)
-            for home in homes:
-                devices = self.get_devices_from_home_iter(
-                    _country, home.homeid, home.owner
-                )
-                yield from devices
-
-    def get_device_details_from_home(self, token: str, country: Optional[str] = None):
-        devices = self.get_devices_iter(country)
-        matching_token = filter(lambda device: device.token == token, devices)
-        if match := next(matching_token, None):
-            return match.country, match.user_id, match.device_id, match.model
-
-        return None, None, None, None
-
-    def get_device_details(self, token: str,
-                           country: Optional[str]) -> Tuple[Optional[str], Optional[str], Optional[str], Optional[str]]:
-        countries_to_check = CONF_AVAILABLE_COUNTRIES
-        if country is not None:
-            countries_to_check = [country]
-        for c in countries_to_check:
-            devices = self.get_devices(c)
-            if devices is None:
-                continue
-            found = list(filter(lambda d: str(d["token"]).casefold() == str(token).casefold(),
-                                devices["result"]["list"]))
-            if len(found) > 0:
-                user_id = found[0]["uid"]
-                device_id = found[0]["did"]
-                model = found[0]["model"]
-                return c, user_id, device_id, model
-        return self.get_device_details_from_home(token, country)
-
-    def get_devices(self, country: str) -> Any:
-        url = self.get_api_url(country) + "/home/device_list"
-        params = {
+    @staticmethod
+    def __get_devices_params__() -> Dict[str, str]:
+        return {
             "data": '{"getVirtualModel":false,"getHuamiDevices":0}'
         }
-        return self.execute_api_call_encrypted(url, params)
 
-    def execute_api_call_encrypted(self, url: str, params: Dict[str, str]) -> Any:
+    @staticmethod
+    def __find_device__(devices: Any, token: str) -> Optional[Tuple[str, str, str]]:
+        if devices is None:
+            return None
+        found = list(filter(lambda d: str(d["token"]).casefold() == str(token).casefold(),
+                            devices["result"]["list"]))
+        if len(found) > 0:
+            return found[0]["uid"], found[0]["did"], found[0]["model"]
+        return None
+
+    def __prepare_api_call__(self, url: str, params: Dict[str, str]) \
+            -> Tuple[Dict[str, str], Dict[str, str], Dict[str, str]]:
         headers = {
             "Accept-Encoding": "identity",
             "User-Agent": self._agent,
@@ -266,13 +430,11 @@ class XiaomiCloudConnector:
         nonce = self.generate_nonce(millis)
         signed_nonce = self.signed_nonce(nonce)
         fields = self.generate_enc_params(url, "POST", signed_nonce, nonce, params, self._ssecurity)
+        return headers, cookies, fields
 
-        try:
-            response = self._session.post(url, headers=headers, cookies=cookies, params=fields, timeout=10)
-        except:
-            response = None
-        if response is not None and response.status_code == 200:
-            decoded = self.decrypt_rc4(self.signed_nonce(fields["_nonce"]), response.text)
+    def __handle_api_call_response__(self, status: Optional[int], text: Optional[str], fields: Dict[str, str]) -> Any:
+        if status == 200:
+            decoded = self.decrypt_rc4(self.signed_nonce(fields["_nonce"]), text)
             return json.loads(decoded)
         return None
 
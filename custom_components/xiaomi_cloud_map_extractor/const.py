@@ -17,7 +17,10 @@ CONF_FORCE_API = "force_api"
 CONF_FONT = "font"
 CONF_FONT_SIZE = "font_size"
 CONF_LEFT = "left"
+CONF_MAP_NAME_CACHE_TIME = "map_name_cache_time"
 CONF_MAP_TRANSFORM = "map_transformation"
+CONF_PATH_SIMPLIFICATION = "path_simplification"
+CONF_PATH_SUPERSAMPLING = "path_supersampling"
 CONF_RIGHT = "right"
 CONF_ROOM_COLORS = "room_colors"
 CONF_ROTATE = "rotate"
@@ -66,6 +69,8 @@ ATTRIBUTE_IGNORED_OBSTACLES = "ignored_obstacles"
 ATTRIBUTE_IGNORED_OBSTACLES_WITH_PHOTO = "ignored_obstacles_with_photo"
 ATTRIBUTE_IMAGE = "image"
 ATTRIBUTE_IS_EMPTY = "is_empty"
+ATTRIBUTE_MAP_CACHE_HITS = "map_cache_hits"
+ATTRIBUTE_MAP_CACHE_MISSES = "map_cache_misses"
 ATTRIBUTE_MAP_NAME = "map_name"
 ATTRIBUTE_MOP_PATH = "mop_path"
 ATTRIBUTE_MAP_SAVED = "map_saved"
@@ -87,7 +92,8 @@ CONF_AVAILABLE_ATTRIBUTES = [ATTRIBUTE_CALIBRATION, ATTRIBUTE_CARPET_MAP, ATTRIB
                              ATTRIBUTE_CHARGER, ATTRIBUTE_CLEANED_ROOMS, ATTRIBUTE_COUNTRY,
                              ATTRIBUTE_GOTO, ATTRIBUTE_GOTO_PATH, ATTRIBUTE_GOTO_PREDICTED_PATH,
                              ATTRIBUTE_IGNORED_OBSTACLES, ATTRIBUTE_IGNORED_OBSTACLES_WITH_PHOTO, ATTRIBUTE_IMAGE,
-                             ATTRIBUTE_IS_EMPTY, ATTRIBUTE_MAP_NAME, ATTRIBUTE_MOP_PATH, ATTRIBUTE_NO_GO_AREAS,
+                             ATTRIBUTE_IS_EMPTY, ATTRIBUTE_MAP_CACHE_HITS, ATTRIBUTE_MAP_CACHE_MISSES,
+                             ATTRIBUTE_MAP_NAME, ATTRIBUTE_MOP_PATH, ATTRIBUTE_NO_GO_AREAS,
                              ATTRIBUTE_NO_MOPPING_AREAS, ATTRIBUTE_OBSTACLES, ATTRIBUTE_OBSTACLES_WITH_PHOTO,
                              ATTRIBUTE_PATH, ATTRIBUTE_ROOMS, ATTRIBUTE_ROOM_NUMBERS, ATTRIBUTE_VACUUM_POSITION,
                              ATTRIBUTE_VACUUM_ROOM, ATTRIBUTE_VACUUM_ROOM_NAME, ATTRIBUTE_WALLS, ATTRIBUTE_ZONES]
@@ -148,6 +154,9 @@ CONF_AVAILABLE_DRAWABLES = [DRAWABLE_ALL, DRAWABLE_CLEANED_AREA, DRAWABLE_CHARGE
                             DRAWABLE_OBSTACLES_WITH_PHOTO, DRAWABLE_PATH, DRAWABLE_PREDICTED_PATH, DRAWABLE_ROOM_NAMES,
                             DRAWABLE_VACUUM_POSITION, DRAWABLE_VIRTUAL_WALLS, DRAWABLE_ZONES]
 
+DYNAMIC_DRAWABLES = [DRAWABLE_GOTO_PATH, DRAWABLE_MOP_PATH, DRAWABLE_PATH, DRAWABLE_PREDICTED_PATH,
+                     DRAWABLE_VACUUM_POSITION]
+
 COLOR_ROOM_PREFIX = "color_room_"
 
 COLOR_CARPETS = "color_carpets"
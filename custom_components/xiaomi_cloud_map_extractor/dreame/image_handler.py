@@ -1,15 +1,15 @@
 import logging
 from enum import IntEnum
-from typing import Dict, Tuple
+from typing import Dict, Optional, Tuple
 
-from PIL import Image
 from PIL.Image import Image as ImageType
 
 from custom_components.xiaomi_cloud_map_extractor.common.image_handler import ImageHandler
+from custom_components.xiaomi_cloud_map_extractor.common.map_data import ImageDimensions
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import Room
 from custom_components.xiaomi_cloud_map_extractor.const import \
-    CONF_SCALE, CONF_TRIM, CONF_LEFT, CONF_RIGHT, CONF_TOP, CONF_BOTTOM, \
-    COLOR_MAP_OUTSIDE, COLOR_MAP_INSIDE, COLOR_MAP_WALL, COLOR_ROOM_PREFIX
+    CONF_SCALE, COLOR_MAP_OUTSIDE, COLOR_MAP_INSIDE, COLOR_MAP_WALL, COLOR_ROOM_PREFIX
+from custom_components.xiaomi_cloud_map_extractor.types import Color
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -21,66 +21,63 @@ class ImageHandlerDreame(ImageHandler):
         WALL = 2
 
     @staticmethod
-    def parse(raw_data: bytes, header, colors, image_config, map_data_type: str) -> Tuple[ImageType, Dict[int, Room]]:
-        scale = image_config[CONF_SCALE]
-        trim_left = int(image_config[CONF_TRIM][CONF_LEFT] * header.image_width / 100)
-        trim_right = int(image_config[CONF_TRIM][CONF_RIGHT] * header.image_width / 100)
-        trim_top = int(image_config[CONF_TRIM][CONF_TOP] * header.image_height / 100)
-        trim_bottom = int(image_config[CONF_TRIM][CONF_BOTTOM] * header.image_height / 100)
-        trimmed_height = header.image_height - trim_top - trim_bottom
-        trimmed_width = header.image_width - trim_left - trim_right
-        image = Image.new('RGBA', (trimmed_width, trimmed_height))
+    def parse(raw_data: bytes, header, colors, image_config, map_data_type: str, find_rooms: bool = True) \
+            -> Tuple[ImageType, Dict[int, Room]]:
         if header.image_width == 0 or header.image_height == 0:
             return ImageHandler.create_empty_map_image(colors), {}
-        pixels = image.load()
-        rooms = {}
+        trim_left, trim_right, trim_top, trim_bottom = ImageDimensions.get_trim(header.image_width,
+                                                                                header.image_height, image_config)
+        trim_box = (trim_left, trim_bottom, header.image_width - trim_right, header.image_height - trim_top)
+
+        # both layouts are decoded through lookup tables built for distinct pixel types
+        if map_data_type == "rism":
+            get_room_number = ImageHandlerDreame.__get_rism_room_number__
+        else:
+            get_room_number = ImageHandlerDreame.__get_regular_room_number__
+
+        def get_pixel_color(px: int) -> Optional[Color]:
+            segment_id = get_room_number(px)
+            if segment_id is not None:
+                default = ImageHandler.ROOM_COLORS[segment_id >> 1]
+                return ImageHandler.__get_color__(f"{COLOR_ROOM_PREFIX}{segment_id}", colors, default)
+            if map_data_type == "rism":
+                if px >> 7:
+                    return ImageHandler.__get_color__(COLOR_MAP_WALL, colors)
+                return None
+            masked_px = px & 0b00000011
+            if masked_px == ImageHandlerDreame.PixelTypes.NONE:
+                return ImageHandler.__get_color__(COLOR_MAP_OUTSIDE, colors)
+            if masked_px == ImageHandlerDreame.PixelTypes.FLOOR:
+                return ImageHandler.__get_color__(COLOR_MAP_INSIDE, colors)
+            if masked_px == ImageHandlerDreame.PixelTypes.WALL:
+                return ImageHandler.__get_color__(COLOR_MAP_WALL, colors)
+            _LOGGER.warning(f'unhandled pixel type: {px}')
+            return None
 
-        for img_y in range(trimmed_height):
-            for img_x in range(trimmed_width):
-                x = img_x
-                y = trimmed_height - img_y - 1
-                room_x = img_x + trim_left
-                room_y = img_y + trim_bottom
+        image = ImageHandler.create_indexed_image(
+            ImageHandler.load_pixel_types(raw_data, header.image_width, header.image_height, trim_box, True),
+            get_pixel_color)
 
-                # TODO : use MapDataParserDreame.MapDataTypes enum
-                if map_data_type == "regular":
-                    px = raw_data[img_x + trim_left + header.image_width * (img_y + trim_bottom)]
-                    segment_id = px >> 2
-                    if 0 < segment_id < 62:
-                        if segment_id not in rooms:
-                            rooms[segment_id] = Room(segment_id, room_x, room_y, room_x, room_y)
-                        rooms[segment_id] = Room(segment_id,
-                                                 min(rooms[segment_id].x0, room_x), min(rooms[segment_id].y0, room_y),
-                                                 max(rooms[segment_id].x1, room_x), max(rooms[segment_id].y1, room_y))
-                        default = ImageHandler.ROOM_COLORS[segment_id >> 1]
-                        pixels[x, y] = ImageHandler.__get_color__(f"{COLOR_ROOM_PREFIX}{segment_id}", colors, default)
-                    else:
-                        masked_px = px & 0b00000011
+        rooms = {}
+        if find_rooms:
+            pixel_types = ImageHandler.load_pixel_types(raw_data, header.image_width, header.image_height, trim_box)
+            room_bounding_boxes = ImageHandler.get_room_bounding_boxes(pixel_types, get_room_number,
+                                                                       (trim_left, trim_bottom))
+            rooms = {segment_id: Room(segment_id, *bounding_box)
+                     for segment_id, bounding_box in room_bounding_boxes.items()}
 
-                        if masked_px == ImageHandlerDreame.PixelTypes.NONE:
-                            pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_OUTSIDE, colors)
-                        elif masked_px == ImageHandlerDreame.PixelTypes.FLOOR:
-                            pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_INSIDE, colors)
-                        elif masked_px == ImageHandlerDreame.PixelTypes.WALL:
-                            pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_WALL, colors)
-                        else:
-                            _LOGGER.warning(f'unhandled pixel type: {px}')
-                elif map_data_type == "rism":
-                    px = raw_data[img_x + trim_left + header.image_width * (img_y + trim_bottom)]
-                    segment_id = px & 0b01111111
-                    wall_flag = px >> 7
+        return ImageHandler.scale(image, image_config[CONF_SCALE]), rooms
 
-                    if wall_flag:
-                        pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_WALL, colors)
-                    elif segment_id > 0:
-                        if segment_id not in rooms:
-                            rooms[segment_id] = Room(segment_id, room_x, room_y, room_x, room_y)
-                        rooms[segment_id] = Room(segment_id,
-                                                 min(rooms[segment_id].x0, room_x), min(rooms[segment_id].y0, room_y),
-                                                 max(rooms[segment_id].x1, room_x), max(rooms[segment_id].y1, room_y))
-                        default = ImageHandler.ROOM_COLORS[segment_id >> 1]
-                        pixels[x, y] = ImageHandler.__get_color__(f"{COLOR_ROOM_PREFIX}{segment_id}", colors, default)
+    @staticmethod
+    def __get_regular_room_number__(px: int) -> Optional[int]:
+        # segment id is stored in upper 6 bits, pixel type in lower 2 bits
+        segment_id = px >> 2
+        return segment_id if 0 < segment_id < 62 else None
 
-        if image_config["scale"] != 1 and header.image_width != 0 and header.image_height != 0:
-            image = image.resize((int(trimmed_width * scale), int(trimmed_height * scale)), resample=Image.NEAREST)
-        return image, rooms
+    @staticmethod
+    def __get_rism_room_number__(px: int) -> Optional[int]:
+        # segment id is stored in lower 7 bits, the highest bit is a wall flag
+        if px >> 7:
+            return None
+        segment_id = px & 0b01111111
+        return segment_id if segment_id > 0 else None
@@ -2,13 +2,19 @@ import base64
 import json
 import logging
 import re
-import zlib
+from array import array
 from enum import Enum, IntEnum
-from typing import Dict, List, Optional, Tuple
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+from PIL import Image
+from PIL.Image import Image as ImageType
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import Area, ImageData, MapData, Path, Point, Room, \
     Wall
+from custom_components.xiaomi_cloud_map_extractor.common.map_data_decompressor import MapDataDecompressor
 from custom_components.xiaomi_cloud_map_extractor.common.map_data_parser import MapDataParser
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
+from custom_components.xiaomi_cloud_map_extractor.common.parsing_buffer import ParsingBuffer
 from custom_components.xiaomi_cloud_map_extractor.dreame.image_handler import ImageHandlerDreame
 
 _LOGGER = logging.getLogger(__name__)
@@ -17,6 +23,7 @@ _LOGGER = logging.getLogger(__name__)
 class MapDataHeader:
     def __init__(self):
         self.map_index: Optional[int] = None
+        self.frame_id: Optional[int] = None
         self.frame_type: Optional[int] = None
         self.vacuum_position: Optional[Point] = None
         self.charger_position: Optional[Point] = None
@@ -27,6 +34,50 @@ class MapDataHeader:
         self.image_top: Optional[int] = None
 
 
+class MapDataState:
+    """
+    Map decoded from the last I-frame, updated in place by following P-frames.
+    P-frames are assumed to:
+    - follow the previous frame of the same map (same map index and next frame id),
+    - contain only a changed part of an image, placed by their header in pixel grid of I-frame;
+      non-zero pixels replace pixels of the map and zero pixels are left unchanged,
+    - contain current positions of the vacuum and the charger,
+    - continue path ("tr") of previous frames; other additional data replace values of previous frames.
+    P-frames that don't follow the state (e.g. when some frames were missed between updates) can't be applied,
+    so the last map rendered from the state is kept until the next I-frame.
+    """
+
+    def __init__(self):
+        self.header: Optional[MapDataHeader] = None
+        self.image: Optional[ImageType] = None
+        self.additional_data: Dict[str, Any] = {}
+        self.map_data: Optional[MapData] = None
+
+    def reset(self, header: MapDataHeader, image_raw: bytes, additional_data: Dict[str, Any]):
+        self.header = header
+        self.image = Image.frombytes('L', (header.image_width, header.image_height), image_raw)
+        self.additional_data = additional_data
+
+    def is_next_frame(self, header: MapDataHeader) -> bool:
+        return self.header is not None \
+            and header.map_index == self.header.map_index \
+            and (header.frame_id - self.header.frame_id) % 0x10000 == 1
+
+    def apply(self, header: MapDataHeader, image_raw: bytes, additional_data: Dict[str, Any]):
+        if header.image_width > 0 and header.image_height > 0:
+            changes = Image.frombuffer('L', (header.image_width, header.image_height), image_raw, 'raw', 'L', 0, 1)
+            # only pixels of changed area are replaced, changes outside of the map are clipped
+            position = (header.image_left - self.header.image_left, header.image_top - self.header.image_top)
+            self.image.paste(changes, position, changes.point([0x00] + [0xFF] * 255))
+        self.header.frame_id = header.frame_id
+        self.header.vacuum_position = header.vacuum_position
+        self.header.charger_position = header.charger_position
+        path = self.additional_data.get("tr", "") + additional_data.pop("tr", "")
+        self.additional_data.update(additional_data)
+        if path:
+            self.additional_data["tr"] = path
+
+
 class MapDataParserDreame(MapDataParser):
     HEADER_SIZE = 27
     PATH_REGEX = r'(?P<operator>[SL])(?P<x>-?\d+),(?P<y>-?\d+)'
@@ -44,39 +95,55 @@ class MapDataParserDreame(MapDataParser):
         RISM = "rism"  # Room - information
 
     @staticmethod
-    def decode_map(raw_map: str, colors, drawables, texts, sizes, image_config,
-                   map_data_type=MapDataTypes.REGULAR) -> MapData:
+    def decode_map(raw_map: Union[str, bytes], colors, drawables, texts, sizes, image_config,
+                   map_data_type=MapDataTypes.REGULAR, parse_plan: Optional[ParsePlan] = None,
+                   map_state: Optional[MapDataState] = None) -> MapData:
         _LOGGER.debug(f'decoding {map_data_type} type map')
-        raw_map_string = raw_map.replace('_', '/').replace('-', '+')
-        unzipped = zlib.decompress(base64.decodebytes(raw_map_string.encode("utf8")))
-        return MapDataParserDreame.parse(unzipped, colors, drawables, texts, sizes, image_config, map_data_type)
+        # map is encoded with URL-safe base64 alphabet
+        unzipped = MapDataDecompressor.inflate(base64.urlsafe_b64decode(raw_map))
+        return MapDataParserDreame.parse(unzipped, colors, drawables, texts, sizes, image_config, map_data_type,
+                                         parse_plan, map_state)
 
     @staticmethod
     def parse(raw: bytes, colors, drawables, texts, sizes, image_config,
-              map_data_type: MapDataTypes = MapDataTypes.REGULAR, *args, **kwargs) -> Optional[MapData]:
+              map_data_type: MapDataTypes = MapDataTypes.REGULAR, parse_plan: Optional[ParsePlan] = None,
+              map_state: Optional[MapDataState] = None, *args, **kwargs) -> Optional[MapData]:
+        """
+        Parses I-frame of a map or P-frame applied to a map state, which is updated by both of them.
+        """
+        if parse_plan is None:
+            parse_plan = ParsePlan.full()
         map_data = MapData(0, 1000)
 
         header = MapDataParserDreame.parse_header(raw)
 
-        if header.frame_type != MapDataParserDreame.FrameTypes.I_FRAME:
+        is_p_frame = header.frame_type == MapDataParserDreame.FrameTypes.P_FRAME
+        if is_p_frame and (map_state is None or not map_state.is_next_frame(header)):
+            _LOGGER.debug("gap in frame sequence before P-frame %d of map %d, waiting for next I-frame",
+                          header.frame_id, header.map_index)
+            return map_state.map_data if map_state is not None else None
+        if header.frame_type != MapDataParserDreame.FrameTypes.I_FRAME and not is_p_frame:
             _LOGGER.error("unsupported map frame type")
             return
 
         if len(raw) >= MapDataParserDreame.HEADER_SIZE + header.image_width * header.image_height:
-            image_raw = raw[MapDataParserDreame.HEADER_SIZE:
-                            MapDataParserDreame.HEADER_SIZE + header.image_width * header.image_height]
-            additional_data_raw = raw[MapDataParserDreame.HEADER_SIZE + header.image_width * header.image_height:]
-            additional_data_json = json.loads(additional_data_raw.decode("utf8"))
+            buf = ParsingBuffer('map', raw, MapDataParserDreame.HEADER_SIZE, len(raw) - MapDataParserDreame.HEADER_SIZE)
+            image_raw = buf.get_bytes('image', header.image_width * header.image_height)
+            additional_data_json = json.loads(str(buf.get_remaining_bytes('additional_data'), "utf8"))
             _LOGGER.debug(f'map additional_data: {additional_data_json}')
+            if is_p_frame:
+                map_state.apply(header, image_raw, additional_data_json)
+                header = map_state.header
+                image_raw = map_state.image.tobytes()
+                additional_data_json = map_state.additional_data
+            elif map_state is not None:
+                map_state.reset(header, image_raw, additional_data_json)
 
             map_data.charger = header.charger_position
             map_data.vacuum_position = header.vacuum_position
 
-            map_data.image, map_data.rooms = MapDataParserDreame.parse_image(image_raw, header, colors, image_config,
-                                                                             additional_data_json, map_data_type)
-
-            if additional_data_json.get("rism") and \
-                    additional_data_json.get("ris") and additional_data_json["ris"] == 2:
+            rism_map_data = None
+            if additional_data_json.get("rism") and additional_data_json.get("ris") == 2:
                 rism_map_data = MapDataParserDreame.decode_map(
                     additional_data_json["rism"],
                     colors,
@@ -84,8 +151,17 @@ class MapDataParserDreame(MapDataParser):
                     texts,
                     sizes,
                     image_config,
-                    MapDataParserDreame.MapDataTypes.RISM
+                    MapDataParserDreame.MapDataTypes.RISM,
+                    parse_plan
                 )
+
+            # rooms and non-empty image of rism map replace regular ones, so they are not decoded
+            if rism_map_data is None or rism_map_data.image.is_empty:
+                find_rooms = parse_plan.rooms and rism_map_data is None
+                map_data.image, map_data.rooms = MapDataParserDreame.parse_image(
+                    image_raw, header, colors, image_config, additional_data_json, map_data_type, find_rooms)
+
+            if rism_map_data is not None:
                 map_data.no_go_areas = rism_map_data.no_go_areas
                 map_data.no_mopping_areas = rism_map_data.no_mopping_areas
                 map_data.walls = rism_map_data.walls
@@ -95,7 +171,7 @@ class MapDataParserDreame(MapDataParser):
                 if not rism_map_data.image.is_empty:
                     map_data.image = rism_map_data.image
 
-            if additional_data_json.get("tr"):
+            if parse_plan.path and additional_data_json.get("tr"):
                 map_data.path = MapDataParserDreame.parse_path(additional_data_json["tr"])
 
             if additional_data_json.get("vw"):
@@ -110,10 +186,14 @@ class MapDataParserDreame(MapDataParser):
                 active_segment_ids = [sa[0] for sa in additional_data_json["sa"]]
 
             if not map_data.image.is_empty:
+                MapDataParserDreame.simplify_paths(map_data, image_config)
                 if map_data_type == MapDataParserDreame.MapDataTypes.REGULAR:
                     MapDataParserDreame.draw_elements(colors, drawables, sizes, map_data, image_config)
                     ImageHandlerDreame.rotate(map_data.image)
 
+            if map_state is not None:
+                map_state.map_data = map_data
+
         return map_data
 
     @staticmethod
@@ -125,6 +205,7 @@ class MapDataParserDreame(MapDataParser):
             return
 
         header.map_index = MapDataParserDreame.read_int_16_le(raw)
+        header.frame_id = MapDataParserDreame.read_int_16_le(raw, 2)
         header.frame_type = MapDataParserDreame.read_int_8(raw, 4)
         header.vacuum_position = Point(
             MapDataParserDreame.read_int_16_le(raw, 5),
@@ -148,10 +229,12 @@ class MapDataParserDreame(MapDataParser):
 
     @staticmethod
     def parse_image(image_raw: bytes, header: MapDataHeader, colors, image_config,
-                    additional_data_json, map_data_type: MapDataTypes) -> Tuple[ImageData, Dict[int, Room]]:
+                    additional_data_json, map_data_type: MapDataTypes, find_rooms: bool = True) \
+            -> Tuple[ImageData, Dict[int, Room]]:
 
         _LOGGER.debug(f"parse image for map {map_data_type}")
-        image, image_rooms = ImageHandlerDreame.parse(image_raw, header, colors, image_config, map_data_type)
+        image, image_rooms = ImageHandlerDreame.parse(image_raw, header, colors, image_config, map_data_type,
+                                                      find_rooms)
 
         room_names = {}
         if additional_data_json.get("seg_inf"):
@@ -191,21 +274,22 @@ class MapDataParserDreame(MapDataParser):
         r = re.compile(MapDataParserDreame.PATH_REGEX)
         matches = [m.groupdict() for m in r.finditer(path_string)]
 
-        current_path = []
-        path_points = []
-        current_position = Point(0, 0)
+        current_path = array("i")
+        path_coords = []
+        x, y = 0, 0
         for match in matches:
             if match["operator"] == MapDataParserDreame.PathOperators.START:
-                current_path = []
-                path_points.append(current_path)
-                current_position = Point(int(match["x"]), int(match["y"]))
+                current_path = array("i")
+                path_coords.append(current_path)
+                x, y = int(match["x"]), int(match["y"])
             elif match["operator"] == MapDataParserDreame.PathOperators.RELATIVE_LINE:
-                current_position = Point(current_position.x + int(match["x"]), current_position.y + int(match["y"]))
+                x, y = x + int(match["x"]), y + int(match["y"])
             else:
                 _LOGGER.error(f'invalid path operator {match["operator"]}')
-            current_path.append(current_position)
+            current_path.append(x)
+            current_path.append(y)
 
-        return Path(None, None, None, path_points)
+        return Path(None, None, None, path_coords)
 
     @staticmethod
     def parse_areas(areas: list) -> List[Area]:
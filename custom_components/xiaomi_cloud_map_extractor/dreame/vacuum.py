@@ -1,7 +1,10 @@
+from typing import Optional
+
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import MapData
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.common.vacuum_v2 import XiaomiCloudVacuumV2
 from custom_components.xiaomi_cloud_map_extractor.common.xiaomi_cloud_connector import XiaomiCloudConnector
-from custom_components.xiaomi_cloud_map_extractor.dreame.map_data_parser import MapDataParserDreame
+from custom_components.xiaomi_cloud_map_extractor.dreame.map_data_parser import MapDataParserDreame, MapDataState
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, ImageConfig, Sizes, Texts
 
 
@@ -9,6 +12,8 @@ class DreameVacuum(XiaomiCloudVacuumV2):
 
     def __init__(self, connector: XiaomiCloudConnector, country: str, user_id: str, device_id: str, model: str):
         super().__init__(connector, country, user_id, device_id, model)
+        # P-frames of a map are applied to the last decoded I-frame
+        self._map_state = MapDataState()
 
     def get_map_archive_extension(self) -> str:
         return "b64"
@@ -19,6 +24,7 @@ class DreameVacuum(XiaomiCloudVacuumV2):
                    drawables: Drawables,
                    texts: Texts,
                    sizes: Sizes,
-                   image_config: ImageConfig) -> MapData:
-        raw_map_string = raw_map.decode()
-        return MapDataParserDreame.decode_map(raw_map_string, colors, drawables, texts, sizes, image_config)
+                   image_config: ImageConfig,
+                   parse_plan: Optional[ParsePlan] = None) -> MapData:
+        return MapDataParserDreame.decode_map(raw_map, colors, drawables, texts, sizes, image_config,
+                                              parse_plan=parse_plan, map_state=self._map_state)
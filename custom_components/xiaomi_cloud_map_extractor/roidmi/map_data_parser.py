@@ -1,11 +1,14 @@
 import json
 import logging
 import math
+from array import array
 from typing import Dict, List, Optional, Tuple
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import Area, ImageData, MapData, Path, Point, Room, \
     Wall
 from custom_components.xiaomi_cloud_map_extractor.common.map_data_parser import MapDataParser
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
+from custom_components.xiaomi_cloud_map_extractor.common.parsing_buffer import ParsingBuffer
 from custom_components.xiaomi_cloud_map_extractor.const import *
 from custom_components.xiaomi_cloud_map_extractor.roidmi.image_handler import ImageHandlerRoidmi
 
@@ -15,12 +18,16 @@ _LOGGER = logging.getLogger(__name__)
 class MapDataParserRoidmi(MapDataParser):
 
     @staticmethod
-    def parse(raw: bytes, colors, drawables, texts, sizes, image_config, *args, **kwargs) -> MapData:
+    def parse(raw: bytes, colors, drawables, texts, sizes, image_config, parse_plan: Optional[ParsePlan] = None,
+              *args, **kwargs) -> MapData:
+        if parse_plan is None:
+            parse_plan = ParsePlan.full()
         scale = float(image_config[CONF_SCALE])
-        map_image_size = raw.find(bytes([127, 123]))
-        map_image = raw[16:map_image_size + 1]
-        map_info_raw = raw[map_image_size + 1:]
-        map_info = json.loads(map_info_raw)
+        buf = ParsingBuffer('map', raw, 0, len(raw))
+        map_image_size = buf.find(bytes([127, 123]))
+        buf.skip('header', 16)
+        map_image = buf.get_bytes('map_image', map_image_size - 15)
+        map_info = json.loads(str(buf.get_remaining_bytes('map_info'), 'UTF-8'))
         width = map_info["width"]
         height = map_info["height"]
         x_min = map_info["x_min"]
@@ -31,15 +38,17 @@ class MapDataParserRoidmi(MapDataParser):
         map_data = MapData(0, 1000)
         map_data.rooms = MapDataParserRoidmi.parse_rooms(map_info)
         image = MapDataParserRoidmi.parse_image(map_image, width, height, x_min_calc, y_min_calc, resolution,
-                                                colors, image_config, map_data.rooms)
+                                                colors, image_config, map_data.rooms, parse_plan.rooms)
         map_data.image = image
-        map_data.path = MapDataParserRoidmi.parse_path(map_info)
+        if parse_plan.path:
+            map_data.path = MapDataParserRoidmi.parse_path(map_info)
         map_data.vacuum_position = MapDataParserRoidmi.parse_vacuum_position(map_info)
         map_data.charger = MapDataParserRoidmi.parse_charger_position(map_info)
         map_data.no_go_areas, map_data.no_mopping_areas, map_data.walls = MapDataParserRoidmi.parse_areas(map_info)
         if not map_data.image.is_empty:
+            MapDataParserRoidmi.simplify_paths(map_data, image_config)
             MapDataParserRoidmi.draw_elements(colors, drawables, sizes, map_data, image_config)
-            if len(map_data.rooms) > 0 and map_data.vacuum_position is not None:
+            if parse_plan.vacuum_room and len(map_data.rooms) > 0 and map_data.vacuum_position is not None:
                 map_data.vacuum_room = MapDataParserRoidmi.get_current_vacuum_room(map_image, map_data, width)
                 if map_data.vacuum_room is not None:
                     map_data.vacuum_room_name = map_data.rooms[map_data.vacuum_room].name
@@ -65,11 +74,12 @@ class MapDataParserRoidmi(MapDataParser):
 
     @staticmethod
     def parse_image(map_image: bytes, width: int, height: int, min_x: float, min_y: float, resolution: float,
-                    colors: Dict, image_config: Dict, rooms: Dict[int, Room]) -> ImageData:
+                    colors: Dict, image_config: Dict, rooms: Dict[int, Room], find_rooms: bool = True) -> ImageData:
         image_top = 0
         image_left = 0
         room_numbers = list(rooms.keys())
-        image, rooms_raw = ImageHandlerRoidmi.parse(map_image, width, height, colors, image_config, room_numbers)
+        image, rooms_raw = ImageHandlerRoidmi.parse(map_image, width, height, colors, image_config, room_numbers,
+                                                    find_rooms)
         for number, room in rooms_raw.items():
             pf = lambda p: MapDataParserRoidmi.image_to_map(p, resolution, min_x, min_y)
             p1 = pf(Point(room[0] + image_left, room[1] + image_top))
@@ -83,13 +93,14 @@ class MapDataParserRoidmi(MapDataParser):
 
     @staticmethod
     def parse_path(map_info: dict) -> Path:
-        path_points = []
+        coords = []
         if "posArray" in map_info:
             raw_points = json.loads(map_info["posArray"])
             for raw_point in raw_points:
-                point = Point(raw_point[0], raw_point[1])
-                path_points.append(point)
-        return Path(None, None, None, [path_points])
+                coords.append(raw_point[0])
+                coords.append(raw_point[1])
+        path_coords = array("i" if all(isinstance(c, int) for c in coords) else "d", coords)
+        return Path(None, None, None, [path_coords])
 
     @staticmethod
     def parse_vacuum_position(map_info: dict) -> Point:
@@ -1,6 +1,8 @@
-import gzip
+from typing import Optional
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import MapData
+from custom_components.xiaomi_cloud_map_extractor.common.map_data_decompressor import MapDataDecompressor
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.common.vacuum_v2 import XiaomiCloudVacuumV2
 from custom_components.xiaomi_cloud_map_extractor.common.xiaomi_cloud_connector import XiaomiCloudConnector
 from custom_components.xiaomi_cloud_map_extractor.roidmi.map_data_parser import MapDataParserRoidmi
@@ -18,9 +20,10 @@ class RoidmiVacuum(XiaomiCloudVacuumV2):
                    drawables: Drawables,
                    texts: Texts,
                    sizes: Sizes,
-                   image_config: ImageConfig) -> MapData:
-        unzipped = gzip.decompress(raw_map)
-        return MapDataParserRoidmi.parse(unzipped, colors, drawables, texts, sizes, image_config)
+                   image_config: ImageConfig,
+                   parse_plan: Optional[ParsePlan] = None) -> MapData:
+        unzipped = MapDataDecompressor.gunzip(raw_map)
+        return MapDataParserRoidmi.parse(unzipped, colors, drawables, texts, sizes, image_config, parse_plan=parse_plan)
 
     def get_map_archive_extension(self) -> str:
         return "gz"
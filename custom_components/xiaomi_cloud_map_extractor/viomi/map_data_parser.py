@@ -1,14 +1,17 @@
 import logging
 import math
+import sys
+from array import array
 from typing import Dict, List, Optional, Set, Tuple
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import Area, ImageData, MapData, Path, Point, Room, \
     Wall, Zone
 from custom_components.xiaomi_cloud_map_extractor.common.map_data_parser import MapDataParser
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
+from custom_components.xiaomi_cloud_map_extractor.common.parsing_buffer import ParsingBuffer
 from custom_components.xiaomi_cloud_map_extractor.const import *
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, ImageConfig, Sizes, Texts
 from custom_components.xiaomi_cloud_map_extractor.viomi.image_handler import ImageHandlerViomi
-from custom_components.xiaomi_cloud_map_extractor.viomi.parsing_buffer import ParsingBuffer
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -28,7 +31,9 @@ class MapDataParserViomi(MapDataParser):
 
     @staticmethod
     def parse(raw: bytes, colors: Colors, drawables: Drawables, texts: Texts, sizes: Sizes,
-              image_config: ImageConfig, *args, **kwargs) -> MapData:
+              image_config: ImageConfig, parse_plan: Optional[ParsePlan] = None, *args, **kwargs) -> MapData:
+        if parse_plan is None:
+            parse_plan = ParsePlan.full()
         map_data = MapData(0, 1)
         buf = ParsingBuffer('header', raw, 0, len(raw))
         feature_flags = buf.get_uint32('feature_flags')
@@ -42,11 +47,12 @@ class MapDataParserViomi(MapDataParser):
         if feature_flags & MapDataParserViomi.FEATURE_IMAGE != 0:
             MapDataParserViomi.parse_section(buf, 'image', map_id)
             map_data.image, map_data.rooms, map_data.cleaned_rooms = \
-                MapDataParserViomi.parse_image(buf, colors, image_config, DRAWABLE_CLEANED_AREA in drawables)
+                MapDataParserViomi.parse_image(buf, colors, image_config, DRAWABLE_CLEANED_AREA in drawables,
+                                               parse_plan)
 
         if feature_flags & MapDataParserViomi.FEATURE_HISTORY != 0:
             MapDataParserViomi.parse_section(buf, 'history', map_id)
-            map_data.path = MapDataParserViomi.parse_history(buf)
+            map_data.path = MapDataParserViomi.parse_history(buf, parse_plan.path)
 
         if feature_flags & MapDataParserViomi.FEATURE_CHARGE_STATION != 0:
             MapDataParserViomi.parse_section(buf, 'charge_station', map_id)
@@ -95,8 +101,9 @@ class MapDataParserViomi(MapDataParser):
         if map_data.rooms is not None:
             _LOGGER.debug('rooms: %s', [str(room) for number, room in map_data.rooms.items()])
         if not map_data.image.is_empty:
+            MapDataParserViomi.simplify_paths(map_data, image_config)
             MapDataParserViomi.draw_elements(colors, drawables, sizes, map_data, image_config)
-            if len(map_data.rooms) > 0 and map_data.vacuum_position is not None:
+            if parse_plan.vacuum_room and len(map_data.rooms) > 0 and map_data.vacuum_position is not None:
                 map_data.vacuum_room = MapDataParserViomi.get_current_vacuum_room(buf, map_data.vacuum_position)
                 if map_data.vacuum_room is not None:
                     map_data.vacuum_room_name = map_data.rooms[map_data.vacuum_room].name
@@ -124,8 +131,8 @@ class MapDataParserViomi(MapDataParser):
         return None
 
     @staticmethod
-    def parse_image(buf: ParsingBuffer, colors: Colors, image_config: ImageConfig, draw_cleaned_area: bool) \
-            -> Tuple[ImageData, Dict[int, Room], Set[int]]:
+    def parse_image(buf: ParsingBuffer, colors: Colors, image_config: ImageConfig, draw_cleaned_area: bool,
+                    parse_plan: ParsePlan) -> Tuple[ImageData, Dict[int, Room], Set[int]]:
         buf.skip('unknown1', 0x08)
         image_top = 0
         image_left = 0
@@ -147,7 +154,9 @@ class MapDataParserViomi(MapDataParser):
         buf.mark_as_image_beginning()
         image, rooms_raw, cleaned_areas, cleaned_areas_layer = ImageHandlerViomi.parse(buf, image_width, image_height,
                                                                                        colors, image_config,
-                                                                                       draw_cleaned_area)
+                                                                                       draw_cleaned_area,
+                                                                                       parse_plan.rooms,
+                                                                                       parse_plan.cleaned_rooms)
         _LOGGER.debug('img: number of rooms: %d, numbers: %s', len(rooms_raw), rooms_raw.keys())
         rooms = {}
         for number, room in rooms_raw.items():
@@ -160,14 +169,34 @@ class MapDataParserViomi(MapDataParser):
                          additional_layers={DRAWABLE_CLEANED_AREA: cleaned_areas_layer}), rooms, cleaned_areas
 
     @staticmethod
-    def parse_history(buf: ParsingBuffer) -> Path:
-        path_points = []
+    def parse_history(buf: ParsingBuffer, parse_path: bool = True) -> Optional[Path]:
         buf.skip('unknown1', 4)
         history_count = buf.get_uint32('history_count')
-        for _ in range(history_count):
-            mode = buf.get_uint8('mode')  # 0: taxi, 1: working
-            path_points.append(MapDataParserViomi.parse_position(buf, 'path'))
-        return Path(len(path_points), 1, 0, [path_points])
+        # each entry consists of mode (uint8, 0: taxi, 1: working) and position (2 x float32)
+        if not parse_path:
+            buf.skip('history', history_count * 9)
+            return None
+        history = bytearray(buf.get_bytes('history', history_count * 9))
+        # without modes remaining bytes are pairs of little-endian float32 coordinates
+        del history[::9]
+        path_coords = array('f')
+        path_coords.frombytes(history)
+        if sys.byteorder == "big":
+            path_coords.byteswap()
+        if MapDataParserViomi.POSITION_UNKNOWN in path_coords:
+            # positions with unknown coordinate are skipped, so known ones are copied in slices between them
+            known_coords = array('f')
+            start = 0
+            while True:
+                try:
+                    end = path_coords.index(MapDataParserViomi.POSITION_UNKNOWN, start) // 2 * 2
+                except ValueError:
+                    break
+                known_coords.extend(path_coords[start:end])
+                start = end + 2
+            known_coords.extend(path_coords[start:])
+            path_coords = known_coords
+        return Path(len(path_coords) // 2, 1, 0, [path_coords])
 
     @staticmethod
     def parse_restricted_areas(buf: ParsingBuffer) -> Tuple[List[Wall], List[Area]]:
@@ -258,12 +287,4 @@ class MapDataParserViomi(MapDataParser):
 
     @staticmethod
     def parse_unknown_section(buf: ParsingBuffer) -> bool:
-        n = buf._data[buf._offs:].find(buf._data[4:8])
-        if n >= 0:
-            buf._offs += n
-            buf._length -= n
-            return True
-        else:
-            buf._offs += buf._length
-            buf._length = 0
-            return False
+        return buf.skip_to('unknown', buf.get_at(4, 4))
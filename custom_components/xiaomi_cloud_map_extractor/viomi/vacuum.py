@@ -1,6 +1,8 @@
-import zlib
+from typing import Optional
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import MapData
+from custom_components.xiaomi_cloud_map_extractor.common.map_data_decompressor import MapDataDecompressor
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.common.vacuum_v2 import XiaomiCloudVacuumV2
 from custom_components.xiaomi_cloud_map_extractor.common.xiaomi_cloud_connector import XiaomiCloudConnector
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, ImageConfig, Sizes, Texts
@@ -18,9 +20,10 @@ class ViomiVacuum(XiaomiCloudVacuumV2):
                    drawables: Drawables,
                    texts: Texts,
                    sizes: Sizes,
-                   image_config: ImageConfig) -> MapData:
-        unzipped = zlib.decompress(raw_map)
-        return MapDataParserViomi.parse(unzipped, colors, drawables, texts, sizes, image_config)
+                   image_config: ImageConfig,
+                   parse_plan: Optional[ParsePlan] = None) -> MapData:
+        unzipped = MapDataDecompressor.inflate(raw_map)
+        return MapDataParserViomi.parse(unzipped, colors, drawables, texts, sizes, image_config, parse_plan=parse_plan)
 
     def get_map_archive_extension(self) -> str:
         return "zlib"
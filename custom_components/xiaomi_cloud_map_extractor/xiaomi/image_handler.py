@@ -1,12 +1,13 @@
 import logging
-from typing import Set, Tuple
+from typing import Optional, Tuple
 
-from PIL import Image
+from PIL import Image, ImageChops
 from PIL.Image import Image as ImageType
 
 from custom_components.xiaomi_cloud_map_extractor.common.image_handler import ImageHandler
+from custom_components.xiaomi_cloud_map_extractor.common.map_data import ImageDimensions
 from custom_components.xiaomi_cloud_map_extractor.const import *
-from custom_components.xiaomi_cloud_map_extractor.types import Colors, ImageConfig
+from custom_components.xiaomi_cloud_map_extractor.types import Color, Colors, ImageConfig
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,66 +19,71 @@ class ImageHandlerXiaomi(ImageHandler):
     MAP_SCAN = 0x07
 
     @staticmethod
-    def parse(raw_data: bytes, width: int, height: int, carpet_map: Set[int], colors: Colors,
-              image_config: ImageConfig) -> Tuple[ImageType, dict]:
-        rooms = {}
-        scale = image_config[CONF_SCALE]
-        trim_left = int(image_config[CONF_TRIM][CONF_LEFT] * width / 100)
-        trim_right = int(image_config[CONF_TRIM][CONF_RIGHT] * width / 100)
-        trim_top = int(image_config[CONF_TRIM][CONF_TOP] * height / 100)
-        trim_bottom = int(image_config[CONF_TRIM][CONF_BOTTOM] * height / 100)
-        trimmed_height = height - trim_top - trim_bottom
-        trimmed_width = width - trim_left - trim_right
-        image = Image.new('RGBA', (trimmed_width, trimmed_height))
+    def parse(raw_data: bytes, width: int, height: int, carpet_mask: Optional[bytes], colors: Colors,
+              image_config: ImageConfig, find_rooms: bool = True) -> Tuple[ImageType, dict]:
         if width == 0 or height == 0:
             return ImageHandler.create_empty_map_image(colors), {}
-        pixels = image.load()
-        for img_y in range(trimmed_height):
-            for img_x in range(trimmed_width):
-                idx = img_x + trim_left + width * (img_y + trim_bottom)
-                pixel_type = raw_data[idx]
-                x = img_x
-                y = trimmed_height - img_y - 1
-                if idx in carpet_map and (x + y) % 2:
-                    pixels[x, y] = ImageHandler.__get_color__(COLOR_CARPETS, colors)
-                elif pixel_type == ImageHandlerXiaomi.MAP_OUTSIDE:
-                    pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_OUTSIDE, colors)
-                elif pixel_type == ImageHandlerXiaomi.MAP_WALL:
-                    pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_WALL, colors)
-                elif pixel_type == ImageHandlerXiaomi.MAP_INSIDE:
-                    pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_INSIDE, colors)
-                elif pixel_type == ImageHandlerXiaomi.MAP_SCAN:
-                    pixels[x, y] = ImageHandler.__get_color__(COLOR_SCAN, colors)
-                else:
-                    obstacle = pixel_type & 0x07
-                    if obstacle == 0:
-                        pixels[x, y] = ImageHandler.__get_color__(COLOR_GREY_WALL, colors)
-                    elif obstacle == 1:
-                        pixels[x, y] = ImageHandler.__get_color__(COLOR_MAP_WALL_V2, colors)
-                    elif obstacle == 7:
-                        room_number = (pixel_type & 0xFF) >> 3
-                        room_x = img_x + trim_left
-                        room_y = img_y + trim_bottom
-                        if room_number not in rooms:
-                            rooms[room_number] = (room_x, room_y, room_x, room_y)
-                        else:
-                            rooms[room_number] = (min(rooms[room_number][0], room_x),
-                                                  min(rooms[room_number][1], room_y),
-                                                  max(rooms[room_number][2], room_x),
-                                                  max(rooms[room_number][3], room_y))
-                        default = ImageHandler.ROOM_COLORS[room_number >> 1]
-                        pixels[x, y] = ImageHandler.__get_color__(f"{COLOR_ROOM_PREFIX}{room_number}", colors, default)
-                    else:
-                        pixels[x, y] = ImageHandler.__get_color__(COLOR_UNKNOWN, colors)
-        if image_config["scale"] != 1 and width != 0 and height != 0:
-            image = image.resize((int(trimmed_width * scale), int(trimmed_height * scale)), resample=Image.NEAREST)
-        return image, rooms
+        trim_left, trim_right, trim_top, trim_bottom = ImageDimensions.get_trim(width, height, image_config)
+        trimmed_height = height - trim_top - trim_bottom
+        trimmed_width = width - trim_left - trim_right
+        trim_box = (trim_left, trim_bottom, width - trim_right, height - trim_top)
+        overlays = []
+        carpets = None
+        if carpet_mask is not None and 0xFF in carpet_mask:
+            size = width * height
+            carpet_mask = carpet_mask[:size].ljust(size, b"\x00")
+            carpets = ImageHandler.load_pixel_types(carpet_mask, width, height, trim_box, True)
+            carpets = ImageChops.multiply(carpets, ImageHandlerXiaomi.__checkerboard__(trimmed_width, trimmed_height))
+            overlays.append((ImageHandler.__get_color__(COLOR_CARPETS, colors), carpets))
+        image = ImageHandler.create_indexed_image(
+            ImageHandler.load_pixel_types(raw_data, width, height, trim_box, True),
+            lambda pixel_type: ImageHandlerXiaomi.__get_pixel_color__(pixel_type, colors), overlays)
+        rooms = {}
+        if find_rooms:
+            # pixels covered by carpet pattern are not a part of room's area
+            excluded = carpets.transpose(Image.FLIP_TOP_BOTTOM) if carpets is not None else None
+            rooms = ImageHandler.get_room_bounding_boxes(
+                ImageHandler.load_pixel_types(raw_data, width, height, trim_box),
+                ImageHandlerXiaomi.__get_room_number__, (trim_left, trim_bottom), excluded)
+        return ImageHandler.scale(image, image_config[CONF_SCALE]), rooms
 
     @staticmethod
-    def get_room_at_pixel(raw_data: bytes, width: int, x: int, y: int) -> int:
-        room_number = None
-        pixel_type = raw_data[x + width * y]
-        if pixel_type not in [ImageHandlerXiaomi.MAP_INSIDE, ImageHandlerXiaomi.MAP_SCAN]:
-            if pixel_type & 0x07 == 7:
+    def __get_room_number__(pixel_type: int) -> Optional[int]:
+        if pixel_type not in [ImageHandlerXiaomi.MAP_INSIDE, ImageHandlerXiaomi.MAP_SCAN] and pixel_type & 0x07 == 7:
+            return pixel_type >> 3
+        return None
+
+    @staticmethod
+    def __get_pixel_color__(pixel_type: int, colors: Colors) -> Color:
+        if pixel_type == ImageHandlerXiaomi.MAP_OUTSIDE:
+            return ImageHandler.__get_color__(COLOR_MAP_OUTSIDE, colors)
+        elif pixel_type == ImageHandlerXiaomi.MAP_WALL:
+            return ImageHandler.__get_color__(COLOR_MAP_WALL, colors)
+        elif pixel_type == ImageHandlerXiaomi.MAP_INSIDE:
+            return ImageHandler.__get_color__(COLOR_MAP_INSIDE, colors)
+        elif pixel_type == ImageHandlerXiaomi.MAP_SCAN:
+            return ImageHandler.__get_color__(COLOR_SCAN, colors)
+        else:
+            obstacle = pixel_type & 0x07
+            if obstacle == 0:
+                return ImageHandler.__get_color__(COLOR_GREY_WALL, colors)
+            elif obstacle == 1:
+                return ImageHandler.__get_color__(COLOR_MAP_WALL_V2, colors)
+            elif obstacle == 7:
                 room_number = (pixel_type & 0xFF) >> 3
-        return room_number
+                default = ImageHandler.ROOM_COLORS[room_number >> 1]
+                return ImageHandler.__get_color__(f"{COLOR_ROOM_PREFIX}{room_number}", colors, default)
+            else:
+                return ImageHandler.__get_color__(COLOR_UNKNOWN, colors)
+
+    @staticmethod
+    def __checkerboard__(width: int, height: int) -> ImageType:
+        filled_first = (b'\xFF\x00' * (width // 2 + 1))[:width]
+        empty_first = (b'\x00\xFF' * (width // 2 + 1))[:width]
+        # top left pixel of an output image is empty
+        rows = empty_first + filled_first
+        return Image.frombytes('L', (width, height), rows * (height // 2) + rows[:width] * (height % 2))
+
+    @staticmethod
+    def get_room_at_pixel(raw_data: bytes, width: int, x: int, y: int) -> Optional[int]:
+        return ImageHandlerXiaomi.__get_room_number__(raw_data[x + width * y])
@@ -1,8 +1,14 @@
 import logging
-from typing import Tuple, List, Set
+import re
+import sys
+from array import array
+from functools import partial
+from struct import Struct, unpack_from
+from typing import Any, Dict, Optional, Tuple, List
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import *
 from custom_components.xiaomi_cloud_map_extractor.common.map_data_parser import MapDataParser
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, Sizes, Texts
 from custom_components.xiaomi_cloud_map_extractor.xiaomi.image_handler import ImageHandlerXiaomi
 
@@ -31,6 +37,36 @@ class MapDataParserXiaomi(MapDataParser):
     NO_CARPET_AREAS = 19
     DIGEST = 1024
     SIZE = 1024
+    BLOCK_FIELDS = {
+        CHARGER: "charger",
+        PATH: "path",
+        GOTO_PATH: "goto_path",
+        GOTO_PREDICTED_PATH: "predicted_path",
+        CURRENTLY_CLEANED_ZONES: "zones",
+        GOTO_TARGET: "goto",
+        ROBOT_POSITION: "vacuum_position",
+        NO_GO_AREAS: "no_go_areas",
+        VIRTUAL_WALLS: "walls",
+        BLOCKS: "blocks",
+        NO_MOPPING_AREAS: "no_mopping_areas",
+        OBSTACLES: "obstacles",
+        IGNORED_OBSTACLES: "ignored_obstacles",
+        OBSTACLES_WITH_PHOTO: "obstacles_with_photo",
+        IGNORED_OBSTACLES_WITH_PHOTO: "ignored_obstacles_with_photo",
+        CARPET_MAP: "carpet_mask",
+        MOP_PATH: "mop_path",
+        NO_CARPET_AREAS: "no_carpet_areas",
+    }
+    BLOCK_HEADER_STRUCT = Struct("<HHI")
+    POINT_STRUCT = Struct("<2H")
+    POSITION_STRUCT = Struct("<2I")
+    POSITION_WITH_ANGLE_STRUCT = Struct("<3I")
+    PATH_HEADER_STRUCT = Struct("<4I")
+    LINE_STRUCT = Struct("<4H")
+    AREA_STRUCT = Struct("<8H")
+    # maps every non-zero value of carpet block to 0xFF
+    CARPET_MASK_TABLE = bytes([0x00] + [0xFF] * 255)
+    CARPET_RUN_PATTERN = re.compile(b"[^\x00]+")
     KNOWN_OBSTACLE_TYPES = {
         0: 'cable',
         2: 'shoes',
@@ -42,87 +78,47 @@ class MapDataParserXiaomi(MapDataParser):
 
     @staticmethod
     def parse(raw: bytes, colors: Colors, drawables: Drawables, texts: Texts, sizes: Sizes,
-              image_config: ImageConfig, *args, **kwargs) -> MapData:
+              image_config: ImageConfig, parse_plan: Optional[ParsePlan] = None, *args, **kwargs) -> MapData:
+        if parse_plan is None:
+            parse_plan = ParsePlan.full()
         map_data = MapData(25500, 1000)
+        # blocks are accessed through views of raw data to avoid copying them
+        raw = memoryview(raw)
         map_header_length = MapDataParserXiaomi.get_int16(raw, 0x02)
         map_data.major_version = MapDataParserXiaomi.get_int16(raw, 0x08)
         map_data.minor_version = MapDataParserXiaomi.get_int16(raw, 0x0A)
         map_data.map_index = MapDataParserXiaomi.get_int32(raw, 0x0C)
         map_data.map_sequence = MapDataParserXiaomi.get_int32(raw, 0x10)
-        block_start_position = map_header_length
-        img_start = None
-        img_data = None
-        while block_start_position < len(raw):
-            block_header_length = MapDataParserXiaomi.get_int16(raw, block_start_position + 0x02)
-            header = MapDataParserXiaomi.get_bytes(raw, block_start_position, block_header_length)
-            block_type = MapDataParserXiaomi.get_int16(header, 0x00)
-            block_data_length = MapDataParserXiaomi.get_int32(header, 0x04)
-            block_data_start = block_start_position + block_header_length
-            data = MapDataParserXiaomi.get_bytes(raw, block_data_start, block_data_length)
-
-            if block_type == MapDataParserXiaomi.CHARGER:
-                map_data.charger = MapDataParserXiaomi.parse_object_position(block_data_length, data)
-            elif block_type == MapDataParserXiaomi.IMAGE:
-                img_start = block_start_position
-                img_data_length = block_data_length
-                img_header_length = block_header_length
-                img_data = data
-                img_header = header
-            elif block_type == MapDataParserXiaomi.ROBOT_POSITION:
-                map_data.vacuum_position = MapDataParserXiaomi.parse_object_position(block_data_length, data)
-            elif block_type == MapDataParserXiaomi.PATH:
-                map_data.path = MapDataParserXiaomi.parse_path(block_start_position, header, raw)
-            elif block_type == MapDataParserXiaomi.GOTO_PATH:
-                map_data.goto_path = MapDataParserXiaomi.parse_path(block_start_position, header, raw)
-            elif block_type == MapDataParserXiaomi.GOTO_PREDICTED_PATH:
-                map_data.predicted_path = MapDataParserXiaomi.parse_path(block_start_position, header, raw)
-            elif block_type == MapDataParserXiaomi.CURRENTLY_CLEANED_ZONES:
-                map_data.zones = MapDataParserXiaomi.parse_zones(data, header)
-            elif block_type == MapDataParserXiaomi.GOTO_TARGET:
-                map_data.goto = MapDataParserXiaomi.parse_goto_target(data)
+        blocks = MapDataParserXiaomi.index_blocks(raw, map_header_length)
+        for block_type, block in blocks.items():
+            if block_type in MapDataParserXiaomi.BLOCK_FIELDS:
+                loader = partial(MapDataParserXiaomi.parse_block, block_type, block, raw, map_data)
+                map_data.set_lazy_field(MapDataParserXiaomi.BLOCK_FIELDS[block_type], loader)
             elif block_type == MapDataParserXiaomi.DIGEST:
                 map_data.is_valid = True
-            elif block_type == MapDataParserXiaomi.VIRTUAL_WALLS:
-                map_data.walls = MapDataParserXiaomi.parse_walls(data, header)
-            elif block_type == MapDataParserXiaomi.NO_GO_AREAS:
-                map_data.no_go_areas = MapDataParserXiaomi.parse_area(header, data)
-            elif block_type == MapDataParserXiaomi.NO_MOPPING_AREAS:
-                map_data.no_mopping_areas = MapDataParserXiaomi.parse_area(header, data)
-            elif block_type == MapDataParserXiaomi.OBSTACLES:
-                map_data.obstacles = MapDataParserXiaomi.parse_obstacles(data, header)
-            elif block_type == MapDataParserXiaomi.IGNORED_OBSTACLES:
-                map_data.ignored_obstacles = MapDataParserXiaomi.parse_obstacles(data, header)
-            elif block_type == MapDataParserXiaomi.OBSTACLES_WITH_PHOTO:
-                map_data.obstacles_with_photo = MapDataParserXiaomi.parse_obstacles(data, header)
-            elif block_type == MapDataParserXiaomi.IGNORED_OBSTACLES_WITH_PHOTO:
-                map_data.ignored_obstacles_with_photo = MapDataParserXiaomi.parse_obstacles(data, header)
-            elif block_type == MapDataParserXiaomi.BLOCKS:
-                block_pairs = MapDataParserXiaomi.get_int16(header, 0x08)
-                map_data.blocks = MapDataParserXiaomi.get_bytes(data, 0, block_pairs)
-            elif block_type == MapDataParserXiaomi.MOP_PATH:
-                points_mask = MapDataParserXiaomi.get_bytes(raw, block_data_start, block_data_length)
-                # only the map_data.path points where points_mask == 1 are in mop_path
-                map_data.mop_path = MapDataParserXiaomi.parse_mop_path(map_data.path, points_mask)
-            elif block_type == MapDataParserXiaomi.CARPET_MAP:
-                data = MapDataParserXiaomi.get_bytes(raw, block_data_start, block_data_length)
-                # only the indexes where value == 1 are in carpet_map
-                map_data.carpet_map = MapDataParserXiaomi.parse_carpet_map(data, image_config)
-            elif block_type == MapDataParserXiaomi.NO_CARPET_AREAS:
-                map_data.no_carpet_areas = MapDataParserXiaomi.parse_area(header, data)
-            else:
-                _LOGGER.debug("UNKNOWN BLOCK TYPE: %s, header length %s, data length %s", block_type, block_header_length, block_data_length)
-            block_start_position = block_start_position + block_data_length + MapDataParserXiaomi.get_int8(header, 2)
+            elif block_type != MapDataParserXiaomi.IMAGE:
+                _LOGGER.debug("UNKNOWN BLOCK TYPE: %s, header length %s, data length %s", block_type,
+                              len(block[1]), len(block[2]))
+        if MapDataParserXiaomi.CARPET_MAP in blocks:
+            map_data.set_lazy_field("carpet_map",
+                                    lambda: MapDataParserXiaomi.get_carpet_runs(map_data.carpet_mask))
 
-        if img_data:
-            image, rooms = MapDataParserXiaomi.parse_image(img_data_length, img_header_length, img_data, img_header, map_data.carpet_map,
-                                                           colors, image_config)
+        image_block = blocks.get(MapDataParserXiaomi.IMAGE)
+        if image_block is not None and image_block[2]:
+            _, img_header, img_data = image_block
+            img_header_length = MapDataParserXiaomi.get_int16(img_header, 0x02)
+            img_data_length = MapDataParserXiaomi.get_int32(img_header, 0x04)
+            image, rooms = MapDataParserXiaomi.parse_image(img_data_length, img_header_length, img_data, img_header,
+                                                           map_data.carpet_mask, colors, image_config,
+                                                           parse_plan.rooms)
             map_data.image = image
             map_data.rooms = rooms
 
         if not map_data.image.is_empty:
+            MapDataParserXiaomi.simplify_paths(map_data, image_config)
             MapDataParserXiaomi.draw_elements(colors, drawables, sizes, map_data, image_config)
-            if len(map_data.rooms) > 0 and map_data.vacuum_position is not None:
-                map_data.vacuum_room = MapDataParserXiaomi.get_current_vacuum_room(img_start, raw,
+            if parse_plan.vacuum_room and len(map_data.rooms) > 0 and map_data.vacuum_position is not None:
+                map_data.vacuum_room = MapDataParserXiaomi.get_current_vacuum_room(img_header, img_data,
                                                                                    map_data.vacuum_position)
             ImageHandlerXiaomi.rotate(map_data.image)
             ImageHandlerXiaomi.draw_texts(map_data.image, texts)
@@ -137,12 +133,56 @@ class MapDataParserXiaomi(MapDataParser):
         return x * MM
 
     @staticmethod
-    def get_current_vacuum_room(block_start_position: int, raw: bytes, vacuum_position: Point) -> int:
-        block_header_length = MapDataParserXiaomi.get_int16(raw, block_start_position + 0x02)
-        header = MapDataParserXiaomi.get_bytes(raw, block_start_position, block_header_length)
+    def index_blocks(raw: memoryview, block_start_position: int) -> Dict[int, Tuple[int, memoryview, memoryview]]:
+        """
+        Finds positions of all blocks without decoding them.
+        Returns mapping of block type to its start position and views of its header and data.
+        """
+        blocks = {}
+        while block_start_position < len(raw):
+            block_type, block_header_length, block_data_length = \
+                MapDataParserXiaomi.BLOCK_HEADER_STRUCT.unpack_from(raw, block_start_position)
+            header = MapDataParserXiaomi.get_bytes(raw, block_start_position, block_header_length)
+            data = MapDataParserXiaomi.get_bytes(raw, block_start_position + block_header_length, block_data_length)
+            blocks[block_type] = (block_start_position, header, data)
+            block_start_position = block_start_position + block_data_length + MapDataParserXiaomi.get_int8(header, 2)
+        return blocks
+
+    @staticmethod
+    def parse_block(block_type: int, block: Tuple[int, memoryview, memoryview], raw: memoryview,
+                    map_data: MapData) -> Any:
+        block_start_position, header, data = block
         block_data_length = MapDataParserXiaomi.get_int32(header, 0x04)
-        block_data_start = block_start_position + block_header_length
-        data = MapDataParserXiaomi.get_bytes(raw, block_data_start, block_data_length)
+        if block_type in [MapDataParserXiaomi.CHARGER, MapDataParserXiaomi.ROBOT_POSITION]:
+            return MapDataParserXiaomi.parse_object_position(block_data_length, data)
+        if block_type in [MapDataParserXiaomi.PATH, MapDataParserXiaomi.GOTO_PATH,
+                          MapDataParserXiaomi.GOTO_PREDICTED_PATH]:
+            return MapDataParserXiaomi.parse_path(block_start_position, header, raw)
+        if block_type == MapDataParserXiaomi.CURRENTLY_CLEANED_ZONES:
+            return MapDataParserXiaomi.parse_zones(data, header)
+        if block_type == MapDataParserXiaomi.GOTO_TARGET:
+            return MapDataParserXiaomi.parse_goto_target(data)
+        if block_type == MapDataParserXiaomi.VIRTUAL_WALLS:
+            return MapDataParserXiaomi.parse_walls(data, header)
+        if block_type in [MapDataParserXiaomi.NO_GO_AREAS, MapDataParserXiaomi.NO_MOPPING_AREAS,
+                          MapDataParserXiaomi.NO_CARPET_AREAS]:
+            return MapDataParserXiaomi.parse_area(header, data)
+        if block_type in [MapDataParserXiaomi.OBSTACLES, MapDataParserXiaomi.IGNORED_OBSTACLES,
+                          MapDataParserXiaomi.OBSTACLES_WITH_PHOTO, MapDataParserXiaomi.IGNORED_OBSTACLES_WITH_PHOTO]:
+            return MapDataParserXiaomi.parse_obstacles(data, header)
+        if block_type == MapDataParserXiaomi.BLOCKS:
+            block_pairs = MapDataParserXiaomi.get_int16(header, 0x08)
+            return bytes(MapDataParserXiaomi.get_bytes(data, 0, block_pairs))
+        if block_type == MapDataParserXiaomi.MOP_PATH:
+            # only the map_data.path points where points_mask == 1 are in mop_path
+            return MapDataParserXiaomi.parse_mop_path(map_data.path, data)
+        if block_type == MapDataParserXiaomi.CARPET_MAP:
+            return MapDataParserXiaomi.parse_carpet_mask(data)
+        return None
+
+    @staticmethod
+    def get_current_vacuum_room(header: memoryview, data: memoryview, vacuum_position: Point) -> int:
+        block_header_length = MapDataParserXiaomi.get_int16(header, 0x02)
         image_top = MapDataParserXiaomi.get_int32(header, block_header_length - 16)
         image_left = MapDataParserXiaomi.get_int32(header, block_header_length - 12)
         image_width = MapDataParserXiaomi.get_int32(header, block_header_length - 4)
@@ -151,8 +191,9 @@ class MapDataParserXiaomi(MapDataParser):
         return room
 
     @staticmethod
-    def parse_image(block_data_length: int, block_header_length: int, data: bytes, header: bytes, carpet_map: Set[int],
-                    colors: Colors, image_config: ImageConfig) -> Tuple[ImageData, Dict[int, Room]]:
+    def parse_image(block_data_length: int, block_header_length: int, data: bytes, header: bytes,
+                    carpet_mask: Optional[bytes], colors: Colors, image_config: ImageConfig, find_rooms: bool = True) \
+            -> Tuple[ImageData, Dict[int, Room]]:
         image_size = block_data_length
         image_top = MapDataParserXiaomi.get_int32(header, block_header_length - 16)
         image_left = MapDataParserXiaomi.get_int32(header, block_header_length - 12)
@@ -168,7 +209,8 @@ class MapDataParserXiaomi(MapDataParser):
                 < MINIMAL_IMAGE_HEIGHT:
             image_config[CONF_TRIM][CONF_TOP] = 0
             image_config[CONF_TRIM][CONF_BOTTOM] = 0
-        image, rooms_raw = ImageHandlerXiaomi.parse(data, image_width, image_height, carpet_map, colors, image_config)
+        image, rooms_raw = ImageHandlerXiaomi.parse(data, image_width, image_height, carpet_mask, colors,
+                                                    image_config, find_rooms)
         rooms = {}
         for number, room in rooms_raw.items():
             rooms[number] = Room(number, MapDataParserXiaomi.image_to_map(room[0] + image_left),
@@ -184,42 +226,38 @@ class MapDataParserXiaomi(MapDataParser):
                          image, MapDataParserXiaomi.map_to_image), rooms
 
     @staticmethod
-    def parse_carpet_map(data: bytes, image_config: ImageConfig) -> Set[int]:
-        carpet_map = set()
+    def parse_carpet_mask(data: bytes) -> bytes:
+        # pixels with non-zero value are carpeted
+        return bytes(data).translate(MapDataParserXiaomi.CARPET_MASK_TABLE)
 
-        for i, v in enumerate(data):
-            if v:
-                carpet_map.add(i)
-        return carpet_map
+    @staticmethod
+    def get_carpet_runs(carpet_mask: bytes) -> List[List[int]]:
+        """
+        Encodes carpet mask as a list of [start index, length] pairs of consecutive carpeted pixels.
+        """
+        return [[m.start(), m.end() - m.start()] for m in MapDataParserXiaomi.CARPET_RUN_PATTERN.finditer(carpet_mask)]
 
     @staticmethod
     def parse_goto_target(data: bytes) -> Point:
-        x = MapDataParserXiaomi.get_int16(data, 0x00)
-        y = MapDataParserXiaomi.get_int16(data, 0x02)
+        x, y = MapDataParserXiaomi.POINT_STRUCT.unpack_from(data)
         return Point(x, y)
 
     @staticmethod
     def parse_object_position(block_data_length: int, data: bytes) -> Point:
-        x = MapDataParserXiaomi.get_int32(data, 0x00)
-        y = MapDataParserXiaomi.get_int32(data, 0x04)
         a = None
         if block_data_length > 8:
-            a = MapDataParserXiaomi.get_int32(data, 0x08)
+            x, y, a = MapDataParserXiaomi.POSITION_WITH_ANGLE_STRUCT.unpack_from(data)
             if a > 0xFF:
                 a = (a & 0xFF) - 256
+        else:
+            x, y = MapDataParserXiaomi.POSITION_STRUCT.unpack_from(data)
         return Point(x, y, a)
 
     @staticmethod
     def parse_walls(data: bytes, header: bytes) -> List[Wall]:
         wall_pairs = MapDataParserXiaomi.get_int16(header, 0x08)
-        walls = []
-        for wall_start in range(0, wall_pairs * 8, 8):
-            x0 = MapDataParserXiaomi.get_int16(data, wall_start + 0)
-            y0 = MapDataParserXiaomi.get_int16(data, wall_start + 2)
-            x1 = MapDataParserXiaomi.get_int16(data, wall_start + 4)
-            y1 = MapDataParserXiaomi.get_int16(data, wall_start + 6)
-            walls.append(Wall(x0, y0, x1, y1))
-        return walls
+        records = MapDataParserXiaomi.iter_records(MapDataParserXiaomi.LINE_STRUCT, data, wall_pairs)
+        return [Wall(x0, y0, x1, y1) for x0, y0, x1, y1 in records]
 
     @staticmethod
     def parse_obstacles(data: bytes, header: bytes) -> List[Obstacle]:
@@ -228,86 +266,79 @@ class MapDataParserXiaomi(MapDataParser):
         if obstacle_pairs == 0:
             return obstacles
         obstacle_size = int(len(data) / obstacle_pairs)
-        for obstacle_start in range(0, obstacle_pairs * obstacle_size, obstacle_size):
-            x = MapDataParserXiaomi.get_int16(data, obstacle_start + 0)
-            y = MapDataParserXiaomi.get_int16(data, obstacle_start + 2)
+        obstacle_struct = MapDataParserXiaomi.get_obstacle_struct(obstacle_size)
+        for record in MapDataParserXiaomi.iter_records(obstacle_struct, data, obstacle_pairs):
+            x, y = record[0:2]
             details = {}
             if obstacle_size >= 6:
-                details[ATTR_TYPE] = MapDataParserXiaomi.get_int16(data, obstacle_start + 4)
+                details[ATTR_TYPE] = record[2]
                 if details[ATTR_TYPE] in MapDataParserXiaomi.KNOWN_OBSTACLE_TYPES:
                     details[ATTR_DESCRIPTION] = MapDataParserXiaomi.KNOWN_OBSTACLE_TYPES[details[ATTR_TYPE]]
                 if obstacle_size >= 10:
-                    u1 = MapDataParserXiaomi.get_int16(data, obstacle_start + 6)
-                    u2 = MapDataParserXiaomi.get_int16(data, obstacle_start + 8)
+                    u1, u2 = record[3:5]
                     details[ATTR_CONFIDENCE_LEVEL] = 0 if u2 == 0 else u1 * 10.0 / u2
-                    if obstacle_size == 28 and (data[obstacle_start + 12] & 0xFF) > 0:
-                        txt = MapDataParserXiaomi.get_bytes(data, obstacle_start + 12, 16)
-                        details[ATTR_PHOTO_NAME] = txt.decode('ascii')
+                    if obstacle_size == 28 and record[5][0] > 0:
+                        details[ATTR_PHOTO_NAME] = record[5].decode('ascii')
             obstacles.append(Obstacle(x, y, details))
         return obstacles
 
+    @staticmethod
+    def get_obstacle_struct(obstacle_size: int) -> Struct:
+        # x, y, [type, [confidence numerator, confidence denominator, [2 unknown bytes, photo name]]]
+        if obstacle_size == 28:
+            return Struct("<5H2x16s")
+        fields = 5 if obstacle_size >= 10 else 3 if obstacle_size >= 6 else 2
+        padding = max(obstacle_size - 2 * fields, 0)
+        return Struct(f"<{fields}H{padding}x")
+
     @staticmethod
     def parse_zones(data: bytes, header: bytes) -> List[Zone]:
         zone_pairs = MapDataParserXiaomi.get_int16(header, 0x08)
-        zones = []
-        for zone_start in range(0, zone_pairs * 8, 8):
-            x0 = MapDataParserXiaomi.get_int16(data, zone_start + 0)
-            y0 = MapDataParserXiaomi.get_int16(data, zone_start + 2)
-            x1 = MapDataParserXiaomi.get_int16(data, zone_start + 4)
-            y1 = MapDataParserXiaomi.get_int16(data, zone_start + 6)
-            zones.append(Zone(x0, y0, x1, y1))
-        return zones
+        records = MapDataParserXiaomi.iter_records(MapDataParserXiaomi.LINE_STRUCT, data, zone_pairs)
+        return [Zone(x0, y0, x1, y1) for x0, y0, x1, y1 in records]
 
     @staticmethod
     def parse_path(block_start_position: int, header: bytes, raw: bytes) -> Path:
-        path_points = []
-        end_pos = MapDataParserXiaomi.get_int32(header, 0x04)
-        point_length = MapDataParserXiaomi.get_int32(header, 0x08)
-        point_size = MapDataParserXiaomi.get_int32(header, 0x0C)
-        angle = MapDataParserXiaomi.get_int32(header, 0x10)
+        end_pos, point_length, point_size, angle = MapDataParserXiaomi.PATH_HEADER_STRUCT.unpack_from(header, 0x04)
         start_pos = block_start_position + 0x14
-        for pos in range(start_pos, start_pos + end_pos, 4):
-            x = MapDataParserXiaomi.get_int16(raw, pos)
-            y = MapDataParserXiaomi.get_int16(raw, pos + 2)
-            path_points.append(Point(x, y))
-        return Path(point_length, point_size, angle, [path_points])
+        # points are pairs of little-endian uint16 coordinates
+        path_coords = array("H")
+        path_coords.frombytes(raw[start_pos:start_pos + end_pos - end_pos % 4])
+        if sys.byteorder == "big":
+            path_coords.byteswap()
+        return Path(point_length, point_size, angle, [path_coords])
 
     @staticmethod
     def parse_mop_path(path: Path, mask: bytes) -> Path:
         mop_paths = []
         points_num = 0
         for each_path in path.path:
-            mop_path_points = []
-            for i, point in enumerate(each_path):
-                if mask[i]:
-                    mop_path_points.append(point)
-                    if (i + 1) < len(mask) and not mask[i + 1]:
-                        points_num += len(mop_path_points)
-                        mop_paths.append(mop_path_points)
-                        mop_path_points = []
+            mop_path_coords = array(each_path.typecode)
+            # consecutive points with non-zero mask form a single mop path
+            for run in re.finditer(b"[^\x00]+", mask[:len(each_path) // 2]):
+                start, end = run.span()
+                mop_path_coords = each_path[2 * start:2 * end]
+                if end < len(mask) and not mask[end]:
+                    points_num += end - start
+                    mop_paths.append(mop_path_coords)
+                    mop_path_coords = array(each_path.typecode)
 
-            points_num += len(mop_path_points)
-            mop_paths.append(mop_path_points)
+            points_num += len(mop_path_coords) // 2
+            mop_paths.append(mop_path_coords)
         return Path(points_num, path.point_size, path.angle, mop_paths)
 
     @staticmethod
     def parse_area(header: bytes, data: bytes) -> List[Area]:
         area_pairs = MapDataParserXiaomi.get_int16(header, 0x08)
-        areas = []
-        for area_start in range(0, area_pairs * 16, 16):
-            x0 = MapDataParserXiaomi.get_int16(data, area_start + 0)
-            y0 = MapDataParserXiaomi.get_int16(data, area_start + 2)
-            x1 = MapDataParserXiaomi.get_int16(data, area_start + 4)
-            y1 = MapDataParserXiaomi.get_int16(data, area_start + 6)
-            x2 = MapDataParserXiaomi.get_int16(data, area_start + 8)
-            y2 = MapDataParserXiaomi.get_int16(data, area_start + 10)
-            x3 = MapDataParserXiaomi.get_int16(data, area_start + 12)
-            y3 = MapDataParserXiaomi.get_int16(data, area_start + 14)
-            areas.append(Area(x0, y0, x1, y1, x2, y2, x3, y3))
-        return areas
+        records = MapDataParserXiaomi.iter_records(MapDataParserXiaomi.AREA_STRUCT, data, area_pairs)
+        return [Area(*coords) for coords in records]
+
+    @staticmethod
+    def iter_records(record_struct: Struct, data: bytes, count: int):
+        return record_struct.iter_unpack(memoryview(data)[:count * record_struct.size])
 
     @staticmethod
-    def get_bytes(data: bytes, start_index: int, size: int) -> bytes:
+    def get_bytes(data: memoryview, start_index: int, size: int) -> memoryview:
         return data[start_index: start_index + size]
 
     @staticmethod
@@ -316,14 +347,8 @@ class MapDataParserXiaomi(MapDataParser):
 
     @staticmethod
     def get_int16(data: bytes, address: int) -> int:
-        return \
-            ((data[address + 0] << 0) & 0xFF) | \
-            ((data[address + 1] << 8) & 0xFFFF)
+        return unpack_from("<H", data, address)[0]
 
     @staticmethod
     def get_int32(data: bytes, address: int) -> int:
-        return \
-            ((data[address + 0] << 0) & 0xFF) | \
-            ((data[address + 1] << 8) & 0xFFFF) | \
-            ((data[address + 2] << 16) & 0xFFFFFF) | \
-            ((data[address + 3] << 24) & 0xFFFFFFFF)
+        return unpack_from("<I", data, address)[0]
@@ -1,7 +1,9 @@
-import gzip
-from typing import Optional
+import time
+from typing import Any, Dict, Optional
 
 from custom_components.xiaomi_cloud_map_extractor.common.map_data import MapData
+from custom_components.xiaomi_cloud_map_extractor.common.map_data_decompressor import MapDataDecompressor
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.common.vacuum import XiaomiCloudVacuum
 from custom_components.xiaomi_cloud_map_extractor.types import Colors, Drawables, ImageConfig, Sizes, Texts
 from custom_components.xiaomi_cloud_map_extractor.xiaomi.map_data_parser import MapDataParserXiaomi
@@ -9,15 +11,51 @@ from custom_components.xiaomi_cloud_map_extractor.xiaomi.map_data_parser import
 
 class XiaomiVacuum(XiaomiCloudVacuum):
 
-    def __init__(self, connector, country, user_id, device_id, model):
+    def __init__(self, connector, country, user_id, device_id, model, map_name_cache_time: float = 0):
         super().__init__(connector, country, user_id, device_id, model)
+        self._map_name_cache_time = map_name_cache_time
+        self._last_map_name = None
+        self._last_map_url = None
+        self._last_map_response = None
+        self._last_map_timestamp = None
 
-    def get_map_url(self, map_name: str) -> Optional[str]:
+    async def async_get_raw_map_data(self, map_name: Optional[str]) -> Optional[bytes]:
+        if map_name is None:
+            return None
+        if map_name == self._last_map_name:
+            # map object with the same name has the same content, it doesn't have to be retrieved again
+            if time.monotonic() - self._last_map_timestamp < self._map_name_cache_time:
+                return self._last_map_response
+            response = await self._connector.async_get_raw_map_data(self._last_map_url)
+            if response is not None:
+                self.__store_map_response__(map_name, self._last_map_url, response)
+                return response
+        map_url = await self.async_get_map_url(map_name)
+        response = await self._connector.async_get_raw_map_data(map_url)
+        if response is not None:
+            self.__store_map_response__(map_name, map_url, response)
+        return response
+
+    def __store_map_response__(self, map_name: str, map_url: str, response: bytes):
+        self._last_map_name = map_name
+        self._last_map_url = map_url
+        self._last_map_response = response
+        self._last_map_timestamp = time.monotonic()
+
+    async def async_get_map_url(self, map_name: str) -> Optional[str]:
         url = self._connector.get_api_url(self._country) + "/home/getmapfileurl"
-        params = {
+        api_response = await self._connector.async_execute_api_call_encrypted(url,
+                                                                              self.__get_map_url_params__(map_name))
+        return self.__get_map_url_from_response__(api_response)
+
+    @staticmethod
+    def __get_map_url_params__(map_name: str) -> Dict[str, str]:
+        return {
             "data": '{"obj_name":"' + map_name + '"}'
         }
-        api_response = self._connector.execute_api_call_encrypted(url, params)
+
+    @staticmethod
+    def __get_map_url_from_response__(api_response: Any) -> Optional[str]:
         if api_response is None or \
                 "result" not in api_response or \
                 api_response["result"] is None or \
@@ -31,9 +69,10 @@ class XiaomiVacuum(XiaomiCloudVacuum):
                    drawables: Drawables,
                    texts: Texts,
                    sizes: Sizes,
-                   image_config: ImageConfig) -> MapData:
-        unzipped = gzip.decompress(raw_map)
-        return MapDataParserXiaomi.parse(unzipped, colors, drawables, texts, sizes, image_config)
+                   image_config: ImageConfig,
+                   parse_plan: Optional[ParsePlan] = None) -> MapData:
+        unzipped = MapDataDecompressor.gunzip(raw_map)
+        return MapDataParserXiaomi.parse(unzipped, colors, drawables, texts, sizes, image_config, parse_plan=parse_plan)
 
     def should_get_map_from_vacuum(self) -> bool:
         return True
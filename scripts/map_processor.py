@@ -1,12 +1,17 @@
 import argparse
+import asyncio
 import logging
 import os
+import time
+import tracemalloc
 
+import aiohttp
 import yaml
 from homeassistant import config_entries  # to fix circular imports
 from homeassistant.const import CONF_HOST, CONF_PASSWORD, CONF_TOKEN, CONF_USERNAME
 
 from custom_components.xiaomi_cloud_map_extractor.camera import PLATFORM_SCHEMA, VacuumCamera
+from custom_components.xiaomi_cloud_map_extractor.common.parse_plan import ParsePlan
 from custom_components.xiaomi_cloud_map_extractor.const import *
 from custom_components.xiaomi_cloud_map_extractor.dreame.vacuum import DreameVacuum
 from custom_components.xiaomi_cloud_map_extractor.roidmi.vacuum import RoidmiVacuum
@@ -29,7 +34,7 @@ def open_and_validate_config(filename) -> dict:
     return PLATFORM_SCHEMA(camera_config)
 
 
-def create_camera(config: dict, output_dir: str) -> VacuumCamera:
+def create_camera(config: dict, output_dir: str, session: aiohttp.ClientSession) -> VacuumCamera:
     host = config[CONF_HOST]
     token = config[CONF_TOKEN]
     username = config[CONF_USERNAME]
@@ -47,8 +52,9 @@ def create_camera(config: dict, output_dir: str) -> VacuumCamera:
         drawables = CONF_AVAILABLE_DRAWABLES[1:]
     attributes = CONF_AVAILABLE_ATTRIBUTES
     force_api = config[CONF_FORCE_API]
+    map_name_cache_time = config[CONF_MAP_NAME_CACHE_TIME]
     return VacuumCamera("", host, token, username, password, country, "", False, image_config, colors, drawables, sizes,
-                        texts, attributes, True, True, output_dir, force_api)
+                        texts, attributes, True, True, output_dir, force_api, map_name_cache_time, session)
 
 
 def attributes_to_dict(attributes):
@@ -60,16 +66,14 @@ def attributes_to_dict(attributes):
             output[k] = attributes_to_dict(v)
         return output
     if hasattr(attributes, "as_dict"):
-        output = attributes.as_dict()
+        output = dict(attributes.as_dict())
         for k, v in output.items():
             output[k] = attributes_to_dict(v)
         return output
     return attributes
 
 
-def parse_map_file(map_config, map_filename, api, suffix=""):
-    print(f"Parsing map file \"{map_filename}\" with api \"{api}\"")
-    map_file = open(map_filename, "rb").read()
+def decode_map_file(map_config, map_file, api, parse_plan=None):
     colors = map_config[CONF_COLORS]
     room_colors = map_config[CONF_ROOM_COLORS]
     texts = map_config[CONF_TEXTS]
@@ -81,16 +85,23 @@ def parse_map_file(map_config, map_filename, api, suffix=""):
     if DRAWABLE_ALL in drawables:
         drawables = CONF_AVAILABLE_DRAWABLES[1:]
 
+    if api == CONF_AVAILABLE_API_XIAOMI:
+        return XiaomiVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform, parse_plan)
+    elif api == CONF_AVAILABLE_API_VIOMI:
+        return ViomiVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform, parse_plan)
+    elif api == CONF_AVAILABLE_API_ROIDMI:
+        return RoidmiVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform, parse_plan)
+    elif api == CONF_AVAILABLE_API_DREAME:
+        return DreameVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform, parse_plan)
+    return None
+
+
+def parse_map_file(map_config, map_filename, api, suffix=""):
+    print(f"Parsing map file \"{map_filename}\" with api \"{api}\"")
+    map_file = open(map_filename, "rb").read()
     map_data = None
     try:
-        if api == CONF_AVAILABLE_API_XIAOMI:
-            map_data = XiaomiVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform)
-        elif api == CONF_AVAILABLE_API_VIOMI:
-            map_data = ViomiVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform)
-        elif api == CONF_AVAILABLE_API_ROIDMI:
-            map_data = RoidmiVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform)
-        elif api == CONF_AVAILABLE_API_DREAME:
-            map_data = DreameVacuum.decode_map(None, map_file, colors, drawables, texts, sizes, transform)
+        map_data = decode_map_file(map_config, map_file, api)
     except Exception as e:
         print(f"Failed to parse map data! {e}")
     if map_data is not None:
@@ -105,10 +116,35 @@ def parse_map_file(map_config, map_filename, api, suffix=""):
         print("Failed to parse map data!")
 
 
-def run_download(map_config, data_output_dir):
+def run_benchmark(map_config, map_filename, api, iterations):
+    print(f"Benchmarking map file \"{map_filename}\" with api \"{api}\" ({iterations} iterations)")
+    map_file = open(map_filename, "rb").read()
+    configured_plan = ParsePlan(map_config[CONF_DRAW], map_config[CONF_ATTRIBUTES])
+    for plan_name, parse_plan in [("full", ParsePlan.full()), ("configured", configured_plan)]:
+        times = []
+        for _ in range(iterations):
+            start = time.perf_counter()
+            decode_map_file(map_config, map_file, api, parse_plan)
+            times.append((time.perf_counter() - start) * 1000)
+        print(f"Parse plan {plan_name}: first: {times[0]:.1f} ms, min: {min(times):.1f} ms, "
+              f"avg: {sum(times) / len(times):.1f} ms, max: {max(times):.1f} ms")
+    tracemalloc.start()
+    map_data = decode_map_file(map_config, map_file, api)
+    snapshot = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    statistics = snapshot.statistics("filename")
+    retained = sum(stat.size for stat in statistics)
+    blocks = sum(stat.count for stat in statistics)
+    print(f"Peak memory: {peak / 1024:.1f} KiB, retained: {retained / 1024:.1f} KiB in {blocks} blocks")
+    del map_data
+
+
+async def run_download(map_config, data_output_dir):
     print("Downloading map data...")
-    camera = create_camera(map_config, data_output_dir)
-    camera.update()
+    async with aiohttp.ClientSession() as session:
+        camera = create_camera(map_config, data_output_dir, session)
+        await camera.async_update()
     attributes = camera.extra_state_attributes
     model = attributes[ATTR_MODEL]
     attributes_output_file = open(f"{data_output_dir}/attributes_{model}.yaml", "w")
@@ -143,6 +179,13 @@ if __name__ == '__main__':
     args_parser_parse.add_argument("--map-file", type=str, required=True, help="raw map file")
     args_parser_parse.add_argument("--api", type=str, choices=["xiaomi", "viomi", "roidmi", "dreame"], required=True,
                                    help="used api")
+    args_parser_benchmark = args_subparsers.add_parser("benchmark",
+                                                       help="Measure parsing time and memory of downloaded map file")
+    args_parser_benchmark.add_argument("--config", type=str, required=True, help="camera yaml config file")
+    args_parser_benchmark.add_argument("--map-file", type=str, required=True, help="raw map file")
+    args_parser_benchmark.add_argument("--api", type=str, choices=["xiaomi", "viomi", "roidmi", "dreame"],
+                                       required=True, help="used api")
+    args_parser_benchmark.add_argument("--iterations", type=int, default=10, help="number of iterations")
     args = args_parser.parse_args()
 
     config_filename = args.config
@@ -153,8 +196,10 @@ if __name__ == '__main__':
     if not os.path.exists(output_dir):
         os.mkdir(output_dir)
     if args.mode == "download":
-        run_download(config, output_dir)
+        asyncio.run(run_download(config, output_dir))
     elif args.mode == "parse":
         parse_map_file(config, args.map_file, args.api)
+    elif args.mode == "benchmark":
+        run_benchmark(config, args.map_file, args.api, args.iterations)
     elif args.mode == "test":
         run_test(config, args.test_data)